@@ -1,22 +1,747 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, stream_with_context
+from flask import has_app_context, has_request_context, before_render_template, template_rendered, send_from_directory
+from flask import abort, send_file, stream_template, get_flashed_messages
+from flask.sessions import SecureCookieSessionInterface
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, FloatField, IntegerField, SelectField, BooleanField, PasswordField
 from wtforms.validators import DataRequired, Email, Length
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from werkzeug.security import generate_password_hash, safe_join
+from markupsafe import Markup
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+import click
+import contextlib
+import cProfile
+import csv
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import ast
+import base64
+import functools
+import gzip
+import hashlib
+import io
+import ipaddress
+import itertools
+import json
+import math
+import mimetypes
+import queue
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 import secrets
+import shutil
+import signal
+import urllib.parse
+from collections import OrderedDict
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import images
+import jobs
+import metrics
+import passwords
+import repository
+from repository import User
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = secrets.token_hex(16)
+# Set SECRET_KEY when running more than one worker so sessions survive
+# requests landing on a different process
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
+app.config['DATABASE'] = os.environ.get('DATABASE_PATH', 'travel_booking.db')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 8))
+app.config['DB_BUSY_TIMEOUT'] = float(os.environ.get('DB_BUSY_TIMEOUT', 5.0))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10.0))
+app.config['DATABASE_REPLICAS'] = [path.strip() for path in
+                                   os.environ.get('DATABASE_REPLICAS', '').split(',') if path.strip()]
+app.config['REPLICA_MAX_LAG'] = float(os.environ.get('REPLICA_MAX_LAG', 30))
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 300))
+app.config['USER_SESSION_CACHE'] = os.environ.get('USER_SESSION_CACHE', '1') == '1'
+app.config['CART_COUNT_TTL'] = float(os.environ.get('CART_COUNT_TTL', 60))
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 256))
+app.config['INVENTORY_TTL'] = float(os.environ.get('INVENTORY_TTL', 5))
+app.config['CART_TTL'] = float(os.environ.get('CART_TTL', 7 * 24 * 3600))
+app.config['CART_SWEEP_BATCH'] = int(os.environ.get('CART_SWEEP_BATCH', 500))
+app.config['CART_SWEEP_INTERVAL'] = float(os.environ.get('CART_SWEEP_INTERVAL', 0))
+app.config['CART_SUMMARY_TTL'] = float(os.environ.get('CART_SUMMARY_TTL', 300))
+app.config['CHECKOUT_QUOTE_TTL'] = float(os.environ.get('CHECKOUT_QUOTE_TTL', 3600))
+app.config['METRICS_SQL'] = os.environ.get('METRICS_SQL', '1') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0') == '1'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 10))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['PASSWORD_METHOD'] = os.environ.get('PASSWORD_METHOD', 'scrypt')
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', 2))
+app.config['PASSWORD_QUEUE'] = int(os.environ.get('PASSWORD_QUEUE', 16))
+app.config['PASSWORD_TIMEOUT'] = float(os.environ.get('PASSWORD_TIMEOUT', 5))
+app.config['LOGIN_RATE_WINDOW'] = float(os.environ.get('LOGIN_RATE_WINDOW', 60))
+app.config['LOGIN_IP_LIMIT'] = int(os.environ.get('LOGIN_IP_LIMIT', 30))
+app.config['LOGIN_EMAIL_LIMIT'] = int(os.environ.get('LOGIN_EMAIL_LIMIT', 10))
+app.config['ASSET_DIR'] = os.environ.get('ASSET_DIR', os.path.join(app.static_folder, 'dist'))
+app.config['IMAGE_PROXY'] = os.environ.get('IMAGE_PROXY', '1') == '1'
+app.config['IMAGE_CACHE_DIR'] = os.environ.get('IMAGE_CACHE_DIR', 'image_cache')
+app.config['IMAGE_CACHE_BYTES'] = int(os.environ.get('IMAGE_CACHE_BYTES', 512 * 1024 * 1024))
+app.config['IMAGE_QUALITY'] = int(os.environ.get('IMAGE_QUALITY', 80))
+app.config['IMAGE_FETCH_TIMEOUT'] = float(os.environ.get('IMAGE_FETCH_TIMEOUT', 10))
+app.config['IMAGE_FIXTURE_DIR'] = os.environ.get('IMAGE_FIXTURE_DIR')
+app.config['JOB_BATCH'] = int(os.environ.get('JOB_BATCH', 10))
+app.config['JOB_POLL'] = float(os.environ.get('JOB_POLL', 1))
+app.config['JOB_LEASE'] = float(os.environ.get('JOB_LEASE', 60))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+app.config['JOB_BACKOFF'] = float(os.environ.get('JOB_BACKOFF', 5))
+app.config['MAIL_OUTBOX'] = os.environ.get('MAIL_OUTBOX', 'mail_outbox')
+app.config['MAIL_SENDER'] = os.environ.get('MAIL_SENDER', 'CVC Viagens <reservas@cvc.com.br>')
 
 # Login Manager
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Database connection pool
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    def __init__(self, path, size=8, busy_timeout=5.0, factory=sqlite3.Connection, timeout=10.0):
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.factory = factory
+        # Seconds to wait for a connection when all of them are checked out
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Connections must never cross a fork (gunicorn --preload), so every
+        # process builds its own pool on first use.
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self.checkouts = 0
+        self.waits = 0
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False,
+                               factory=self.factory)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA cache_size = -16000')
+        conn.execute('PRAGMA mmap_size = 134217728')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA busy_timeout = %d' % int(self.busy_timeout * 1000))
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self.checkouts += 1
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._opened < self.size:
+                self._opened += 1
+                opened = True
+            else:
+                self.waits += 1
+                opened = False
+        if opened:
+            try:
+                return self.connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout('no connection to %s freed up within %.1fs (pool size %d)' % (
+                self.path, self.timeout, self.size))
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'opened': self._opened,
+            'idle': self._idle.qsize(),
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+        }
+
+db_pool = ConnectionPool(app.config['DATABASE'], app.config['DB_POOL_SIZE'],
+                         app.config['DB_BUSY_TIMEOUT'],
+                         metrics.TimedConnection if app.config['METRICS_SQL'] else sqlite3.Connection,
+                         app.config['DB_POOL_TIMEOUT'])
+
+# Read replicas. DATABASE_REPLICAS lists read-only copies of the primary
+# (comma separated; on a multi-node setup, files on each node's local disk)
+# that `flask refresh-replicas` rewrites from the primary with the online
+# backup API. A refreshed copy is renamed into place with its mtime set to
+# the moment its read transaction began, so a replica's mtime tells which
+# commits it holds. Views in READ_ENDPOINTS read from a replica at most
+# REPLICA_MAX_LAG seconds old, taken after the last catalog write (so every
+# package a cached listing shows is there) and, once their session has
+# written anything, after that write too; otherwise from the primary.
+READ_ENDPOINTS = {'home', 'search', 'package_detail', 'profile', 'admin', 'api_packages',
+                  'api_search', 'export_table'}
+
+class SnapshotPool(ConnectionPool):
+    # Replica files are replaced, never written, so connections open them
+    # immutable: no locks and no journal, and an open connection keeps
+    # reading the copy it opened. After a refresh idle connections are
+    # closed and busy ones are closed on release.
+    def _reset(self):
+        super()._reset()
+        self._stamp = None
+        self._generations = {}
+
+    def snapshot_time(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def connect(self):
+        uri = 'file:%s?mode=ro&immutable=1' % urllib.parse.quote(os.path.abspath(self.path))
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=self.factory)
+        conn.execute('PRAGMA cache_size = -16000')
+        conn.execute('PRAGMA mmap_size = 134217728')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        self._generations[id(conn)] = self._stamp
+        return conn
+
+    def acquire(self):
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        stale = []
+        with self._lock:
+            if self._pid == os.getpid() and stamp != self._stamp:
+                self._stamp = stamp
+                while True:
+                    try:
+                        stale.append(self._idle.get_nowait())
+                    except queue.Empty:
+                        break
+                self._opened -= len(stale)
+        for conn in stale:
+            self._generations.pop(id(conn), None)
+            conn.close()
+        return super().acquire()
+
+    def release(self, conn):
+        if self._pid == os.getpid() and self._generations.get(id(conn)) != self._stamp:
+            self._generations.pop(id(conn), None)
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        super().release(conn)
+
+class ReplicaSet:
+    def __init__(self, pools, max_lag):
+        self.pools = pools
+        self.max_lag = max_lag
+        self._turn = itertools.count()
+
+    def pick(self, fresh_since=0.0):
+        # A replica holding every commit up to fresh_since, round robin; None
+        # means read from the primary
+        oldest = max(fresh_since, time.time() - self.max_lag)
+        fresh = [pool for pool in self.pools if (pool.snapshot_time() or 0) >= oldest]
+        if not fresh:
+            return None
+        return fresh[next(self._turn) % len(fresh)]
+
+replicas = ReplicaSet([SnapshotPool(path, app.config['DB_POOL_SIZE'],
+                                    factory=db_pool.factory, timeout=db_pool.timeout)
+                       for path in app.config['DATABASE_REPLICAS']],
+                      app.config['REPLICA_MAX_LAG'])
+
+def read_pool(fresh_since=0.0):
+    return replicas.pick(fresh_since) or db_pool
+
+def refresh_replicas(source, paths):
+    # One backup of the primary, copied to every replica and renamed into
+    # place. Readers of the old copy keep their open file until they finish.
+    started = time.time()
+    tmp_paths = ['%s.%d.tmp' % (path, os.getpid()) for path in paths]
+    try:
+        target = sqlite3.connect(tmp_paths[0])
+        try:
+            source.backup(target)
+            # Replicas are opened immutable, which needs a rollback-journal file
+            target.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            target.close()
+        for tmp_path in tmp_paths[1:]:
+            shutil.copyfile(tmp_paths[0], tmp_path)
+        for tmp_path, path in zip(tmp_paths, paths):
+            os.utime(tmp_path, (started, started))
+            os.replace(tmp_path, path)
+    finally:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return started
+
+def get_db():
+    if 'db' not in g:
+        pool = db_pool
+        if has_request_context() and request.endpoint in READ_ENDPOINTS:
+            pool = read_pool(max(session.get('wrote_at', 0.0), catalog.changed_at()))
+        with timed('db_wait'):
+            g.db = pool.acquire()
+        g.db_pool = pool
+        g.db_changes = g.db.total_changes
+        db_reads.inc('primary' if pool is db_pool else 'replica')
+    return g.db
+
+@contextlib.contextmanager
+def pooled_connection(pool):
+    # A request never holds two connections of a pool at once, or
+    # DB_POOL_SIZE requests could each wait forever for a second one: loads
+    # inside a request read through its own connection when it is idle and
+    # at least as fresh as `pool`
+    conn = g.get('db') if has_app_context() else None
+    if conn is not None and not conn.in_transaction and g.db_pool in (pool, db_pool):
+        yield conn
+        return
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(error):
+    app.logger.error('%s', error)
+    return 'Muitos acessos no momento. Tente novamente em instantes.', 503, {'Retry-After': '1'}
+
+@app.after_request
+def remember_write(response):
+    # Read-your-writes: later reads of this session skip replicas older than
+    # this request's commits
+    conn = g.get('db')
+    if (replicas.pools and conn is not None and g.db_pool is db_pool
+            and conn.total_changes != g.db_changes):
+        session['wrote_at'] = time.time()
+    return response
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        g.pop('db_pool', db_pool).release(conn)
+
+def run_transaction(conn, work, retries=5, backoff=0.05):
+    # Runs work(cursor) inside BEGIN IMMEDIATE so the write lock is taken up
+    # front, retrying with jittered exponential backoff while another writer
+    # holds the database past the busy timeout.
+    for attempt in range(retries + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = work(conn.cursor())
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if attempt == retries or ('locked' not in str(e) and 'busy' not in str(e)):
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+# Request metrics, exposed at /metrics in the Prometheus text format. Each
+# worker reports its own numbers; scrape every worker (or run one per port).
+registry = metrics.Registry()
+request_seconds = registry.histogram('http_request_duration_seconds', 'Request latency.',
+                                     ('endpoint', 'method', 'status'))
+section_seconds = registry.histogram('app_section_duration_seconds',
+                                     'Time spent in a part of a request.', ('section',))
+sql_execute_seconds = registry.histogram('sql_execute_duration_seconds',
+                                         'Time in cursor.execute per statement.', ('statement',))
+sql_fetch_seconds = registry.counter('sql_fetch_seconds_total',
+                                     'Time spent fetching rows per statement.', ('statement',))
+sql_rows = registry.counter('sql_rows_total', 'Rows fetched per statement.', ('statement',))
+registry.gauge('db_pool_connections', 'Connection pool state of this worker.', ('state',),
+               lambda: {('opened',): db_pool.stats()['opened'], ('idle',): db_pool.stats()['idle']})
+registry.gauge('db_pool_waits', 'Checkouts that had to wait for a connection.', (),
+               lambda: {(): db_pool.waits})
+db_reads = registry.counter('db_request_connections_total',
+                            'Request connections by database they were routed to.', ('target',))
+registry.gauge('db_replica_age_seconds', 'Age of each replica snapshot.', ('replica',),
+               lambda: {(pool.path,): time.time() - pool.snapshot_time()
+                        for pool in replicas.pools if pool.snapshot_time() is not None})
+slow_profiles = metrics.SlowestProfiles(app.config['PROFILE_DIR'], app.config['PROFILE_KEEP'])
+
+def add_timing(section, seconds):
+    section_seconds.observe(seconds, section)
+    if has_request_context() and 'timings' in g:
+        g.timings[section] = g.timings.get(section, 0.0) + seconds
+
+@contextlib.contextmanager
+def timed(section):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(section, time.perf_counter() - start)
+
+@functools.lru_cache(maxsize=1024)
+def _statement(sql):
+    return metrics.statement_label(sql)
+
+def record_query(sql, seconds, rows, executed):
+    label = _statement(sql)
+    if executed:
+        sql_execute_seconds.observe(seconds, label)
+    else:
+        sql_fetch_seconds.inc(label, value=seconds)
+    if rows:
+        sql_rows.inc(label, value=rows)
+    if has_request_context() and 'timings' in g:
+        g.timings['db'] = g.timings.get('db', 0.0) + seconds
+
+metrics.TimedConnection.observer = record_query
+
+@app.before_request
+def start_request_metrics():
+    g.timings = {}
+    g.request_started = time.perf_counter()
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        slow_profiles.offer(elapsed, profiler, request.endpoint or 'unmatched')
+    request_seconds.observe(elapsed, request.endpoint or 'unmatched', request.method,
+                            str(response.status_code))
+    if app.config['SERVER_TIMING']:
+        parts = ['%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in g.timings.items()]
+        parts.append('total;dur=%.2f' % (elapsed * 1000))
+        response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        add_timing('render', time.perf_counter() - started)
+
+# Static assets. `npm run build` bundles assets/ (Tailwind, the Font Awesome
+# icons in use, the shared scripts) into ASSET_DIR with content hashes in the
+# file names, plus manifest.json mapping each source entry to its files and
+# .br/.gz copies made at build time. A hashed file never changes, so it is
+# cached for a year and served precompressed when the browser accepts it.
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+class AssetManifest:
+    # Re-read when a rebuild (`npm run watch`) replaces the file
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._entries = {}
+        self._warned = False
+        self._lock = threading.Lock()
+
+    def get(self, entry):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if not self._warned:
+                self._warned = True
+                app.logger.warning('%s not found; run `npm run build`, pages load the CDN '
+                                   'stylesheets until then', self.path)
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+                self._mtime = mtime
+            return self._entries.get(entry)
+
+# Endpoints whose responses never depend on the session
+SESSIONLESS_ENDPOINTS = {'dist_asset', 'package_image'}
+
+class AssetSessionInterface(SecureCookieSessionInterface):
+    # No cookie and no Vary: Cookie on assets, so shared caches keep a single
+    # copy
+    def save_session(self, app, session, response):
+        if request.endpoint not in SESSIONLESS_ENDPOINTS:
+            super().save_session(app, session, response)
+
+app.session_interface = AssetSessionInterface()
+
+asset_manifest = AssetManifest(os.path.join(app.config['ASSET_DIR'], 'manifest.json'))
+
+@app.template_global()
+def asset_bundle(entry):
+    # {'js': url, 'css': [urls]} for a build entry; None before the first
+    # build, and base.html falls back to the CDN tags
+    chunk = asset_manifest.get(entry)
+    if chunk is None:
+        return None
+    return {'js': url_for('dist_asset', filename=chunk['file']),
+            'css': [url_for('dist_asset', filename=name) for name in chunk.get('css', ())]}
+
+@app.route('/static/dist/<path:filename>')
+def dist_asset(filename):
+    directory = app.config['ASSET_DIR']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for name, suffix in ASSET_ENCODINGS:
+        path = safe_join(directory, filename + suffix)
+        if request.accept_encodings[name] > 0 and path and os.path.isfile(path):
+            encoding = name
+            filename += suffix
+            break
+    response = send_from_directory(directory, filename, mimetype=mimetype,
+                                   max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % ASSET_MAX_AGE
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Package images, resized and served from a local disk cache (images.py)
+# instead of hotlinking full-size remote photos. Links carry a key of the
+# image_url, so changing a package's image changes its links and the
+# responses can be cached for good. Set IMAGE_FIXTURE_DIR to read images from
+# local files named like the URL's last path segment instead of fetching.
+image_cache = images.ImageCache(
+    app.config['IMAGE_CACHE_DIR'], app.config['IMAGE_CACHE_BYTES'],
+    images.fixture_fetcher(app.config['IMAGE_FIXTURE_DIR']) if app.config['IMAGE_FIXTURE_DIR']
+    else functools.partial(images.fetch_url, timeout=app.config['IMAGE_FETCH_TIMEOUT']),
+    quality=app.config['IMAGE_QUALITY'])
+
+# Rendered width of each variant, for the sizes attribute
+IMAGE_SIZES = {
+    'thumb': '48px',
+    'card': '(min-width: 1024px) 400px, (min-width: 768px) 50vw, 100vw',
+    'detail': '(min-width: 1024px) 850px, 100vw',
+}
+
+@app.template_global()
+def image_attrs(package_id, image_url, variant):
+    # src, srcset and sizes for <img>; the remote URL when the proxy is off
+    if not app.config['IMAGE_PROXY'] or not image_url:
+        return Markup('src="%s"') % (image_url or '')
+    key = images.url_key(image_url)
+    widths = images.VARIANTS[variant][2]
+    urls = [url_for('package_image', package_id=package_id, key=key, variant=variant,
+                    width=width) for width in widths]
+    return Markup('src="%s" srcset="%s" sizes="%s"') % (
+        urls[0], ', '.join('%s %dw' % (url, width) for url, width in zip(urls, widths)),
+        IMAGE_SIZES[variant])
+
+def warm_image(image_url):
+    if app.config['IMAGE_PROXY'] and image_url:
+        image_cache.warm(image_url)
+
+@app.route('/images/<int:package_id>/<key>/<variant>-<int:width>.webp')
+def package_image(package_id, key, variant, width):
+    if width not in images.VARIANTS.get(variant, (0, 0, ()))[2]:
+        abort(404)
+    package = catalog.get().by_id.get(package_id)
+    # A stale key means the package's image has changed since the page rendered
+    if package is None or images.url_key(package.image_url) != key:
+        abort(404)
+    try:
+        image = image_cache.open_variant(package.image_url, variant, width)
+    except images.ImageError as e:
+        app.logger.warning('Package %d image unavailable: %s', package_id, e)
+        # The original beats a broken image; retried after images.FAILURE_TTL
+        response = redirect(package.image_url)
+        response.headers['Cache-Control'] = 'public, max-age=%d' % images.FAILURE_TTL
+        return response
+    response = send_file(image, mimetype='image/webp', max_age=ASSET_MAX_AGE,
+                         last_modified=os.fstat(image.fileno()).st_mtime)
+    response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % ASSET_MAX_AGE
+    return response
+
+registry.gauge('image_cache_lookups', 'Package image variant lookups in this worker.',
+               ('result',), lambda: {('hit',): image_cache.hits, ('miss',): image_cache.misses,
+                                     ('error',): image_cache.errors})
+
+# Package catalog cache
+class CatalogSnapshot:
+    def __init__(self, rows, stamp):
+        self.stamp = stamp
+        self.ordered = rows
+        self.by_id = {package.id: package for package in rows}
+        self.featured = [package for package in rows if package.featured][:6]
+        self.by_price = sorted(rows, key=lambda package: (package.price, package.id))
+        # Newest created_at/updated_at, or the last signalled write, which
+        # also covers deletions
+        times = [t for package in rows for t in (package.created_at, package.updated_at) if t]
+        last = datetime.strptime(max(times), '%Y-%m-%d %H:%M:%S') if times else datetime(2000, 1, 1)
+        last = last.replace(tzinfo=timezone.utc)
+        if stamp:
+            last = max(last, datetime.fromtimestamp(stamp[1] // 10**9, timezone.utc))
+        self.last_modified = last
+
+class CatalogCache:
+    # Every worker keeps its own snapshot. Admin writes replace a small signal
+    # file next to the database, and readers compare its stat() against the
+    # stamp of their snapshot, so the steady state never touches SQLite.
+    def __init__(self, signal_path):
+        self.signal_path = signal_path
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.loads = 0
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.signal_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def changed_at(self):
+        # Time of the last catalog write, in seconds since the epoch
+        stamp = self._stamp()
+        return stamp[1] / 1e9 if stamp else 0.0
+
+    def _load(self, stamp):
+        # A replica only serves the load if it holds the write that moved
+        # the stamp
+        with pooled_connection(read_pool(stamp[1] / 1e9 if stamp else 0.0)) as conn:
+            rows = repository.package_cards(conn)
+        self.loads += 1
+        return CatalogSnapshot(rows, stamp)
+
+    def get(self):
+        # The stamp is read before loading so a write that lands mid-load is
+        # picked up again on the next call.
+        stamp = self._stamp()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.stamp != stamp:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.stamp != stamp:
+                    snapshot = self._load(stamp)
+                    self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        # os.replace gives the signal file a new inode, so the stamp changes
+        # even on filesystems with coarse mtimes.
+        tmp_path = '%s.%d.tmp' % (self.signal_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(datetime.now().isoformat())
+        os.replace(tmp_path, self.signal_path)
+        with self._lock:
+            self._snapshot = None
+
+catalog = CatalogCache(app.config['DATABASE'] + '.catalog')
+
+# Rendered page cache for anonymous visitors. Entries are keyed by endpoint,
+# view arguments, query string and catalog stamp, so an admin write simply
+# makes the old keys unreachable; the LRU bound takes care of the rest.
+class CachedPage:
+    def __init__(self, body, last_modified):
+        self.body = body
+        self.gzipped = gzip.compress(body, 6)
+        self.etag = hashlib.sha1(body).hexdigest()[:24]
+        self.last_modified = last_modified
+
+    def response(self):
+        if request.accept_encodings['gzip']:
+            response = app.response_class(self.gzipped, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(self.etag + '-gz')
+        else:
+            response = app.response_class(self.body, mimetype='text/html')
+            response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        response.headers['Cache-Control'] = 'public, no-cache'
+        response.vary.update(('Accept-Encoding', 'Cookie'))
+        return response.make_conditional(request)
+
+class PageCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            page = self._entries.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, page):
+        with self._lock:
+            self._entries[key] = page
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {'size': len(self._entries), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+page_cache = PageCache(app.config['PAGE_CACHE_SIZE'])
+
+def cached_page(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Logged-in pages carry the user's name and cart, and pending flash
+        # messages are one-off, so both always render fresh.
+        if '_flashes' in session or current_user.is_authenticated:
+            return view(*args, **kwargs)
+        snapshot = catalog.get()
+        key = (request.endpoint, tuple(sorted(kwargs.items())),
+               tuple(sorted(request.args.items(multi=True))), snapshot.stamp)
+        page = page_cache.get(key)
+        if page is None:
+            rv = view(*args, **kwargs)
+            if not isinstance(rv, str):
+                return rv
+            page = CachedPage(rv.encode('utf-8'), snapshot.last_modified)
+            page_cache.put(key, page)
+        return page.response()
+    return wrapper
+
 # Forms
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -48,13 +773,673 @@ class PackageForm(FlaskForm):
     transport = StringField('Transporte', validators=[DataRequired()])
     featured = BooleanField('Pacote em destaque')
 
-# Database initialization
-def init_db():
-    conn = sqlite3.connect('travel_booking.db')
+# Dashboard aggregates. booking_stats holds confirmed bookings and revenue per
+# scope ('total', 'package', 'category', 'day', and 'user' for the profile
+# summary); writers fold their changes in inside the same transaction, and
+# rebuild_stats() recomputes everything.
+STATS_SCOPES = [
+    ('total', "''"),
+    ('package', 'CAST(b.package_id AS TEXT)'),
+    ('category', "COALESCE(p.category, '')"),
+    ('day', 'date(b.created_at)'),
+    ('user', 'CAST(b.user_id AS TEXT)'),
+]
+
+def apply_booking_stats(cursor, where, params, sign=1):
+    for scope, key in STATS_SCOPES:
+        cursor.execute('''
+            INSERT INTO booking_stats (scope, key, bookings, revenue)
+            SELECT ?, %s, ? * COUNT(*), ? * SUM(b.total_price)
+            FROM bookings b LEFT JOIN packages p ON p.id = b.package_id
+            WHERE %s
+            GROUP BY 2
+            ON CONFLICT (scope, key) DO UPDATE SET
+                bookings = bookings + excluded.bookings,
+                revenue = revenue + excluded.revenue
+        ''' % (key, where), (scope, sign, sign) + tuple(params))
+
+def restate_package_stats(cursor, package_ids, change):
+    # Bookings are counted under their package's category ('' once the
+    # package is gone), so writes that can change it take the packages'
+    # confirmed bookings out of booking_stats and put them back afterwards
+    where = "b.package_id IN (SELECT value FROM json_each(?)) AND b.status = 'confirmed'"
+    params = (json.dumps(list(package_ids)),)
+    apply_booking_stats(cursor, where, params, sign=-1)
+    change()
+    apply_booking_stats(cursor, where, params)
+
+def bump_counter(cursor, name, delta=1):
+    cursor.execute('''
+        INSERT INTO stats_counters (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+    ''', (name, delta))
+
+def rebuild_stats(conn):
     cursor = conn.cursor()
-    
-    # Users table
+    cursor.execute('DELETE FROM booking_stats')
+    apply_booking_stats(cursor, "b.status = 'confirmed'", ())
+    cursor.execute('DELETE FROM stats_counters')
+    cursor.execute('''
+        INSERT INTO stats_counters (name, value)
+        SELECT 'customers', COUNT(*) FROM users WHERE is_admin = 0
+    ''')
+
+# Package inventory. Packages with rows in package_inventory sell a limited
+# number of seats per day; packages without any rows stay unlimited.
+class SoldOut(Exception):
+    pass
+
+class SeatAccountingError(Exception):
+    # Releasing a booking's seats would leave package_inventory inconsistent
+    pass
+
+class StaleQuote(Exception):
+    pass
+
+def stay_range(check_in, check_out):
+    # Nights of a stay as a half-open [start, end) date range; a same-day
+    # trip still takes one day of capacity
+    try:
+        start = datetime.strptime(check_in, '%Y-%m-%d').date()
+        end = datetime.strptime(check_out, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+    return start, max(end, start + timedelta(days=1))
+
+class CapacityTree:
+    # Range-min segment tree with lazy range-add over the remaining seats per
+    # day, so checking or reserving a stay costs O(log n) in its length.
+    def __init__(self, values):
+        self.n = max(len(values), 1)
+        self._min = [0] * (4 * self.n)
+        self._add = [0] * (4 * self.n)
+        if values:
+            self._build(1, 0, self.n, values)
+
+    def _build(self, node, lo, hi, values):
+        if hi - lo == 1:
+            self._min[node] = values[lo]
+            return
+        mid = (lo + hi) // 2
+        self._build(2 * node, lo, mid, values)
+        self._build(2 * node + 1, mid, hi, values)
+        self._min[node] = min(self._min[2 * node], self._min[2 * node + 1])
+
+    def min(self, lo, hi, node=1, node_lo=0, node_hi=None):
+        if node_hi is None:
+            node_hi = self.n
+        if hi <= node_lo or node_hi <= lo:
+            return float('inf')
+        if lo <= node_lo and node_hi <= hi:
+            return self._min[node]
+        mid = (node_lo + node_hi) // 2
+        return self._add[node] + min(self.min(lo, hi, 2 * node, node_lo, mid),
+                                     self.min(lo, hi, 2 * node + 1, mid, node_hi))
+
+    def add(self, lo, hi, delta, node=1, node_lo=0, node_hi=None):
+        if node_hi is None:
+            node_hi = self.n
+        if hi <= node_lo or node_hi <= lo:
+            return
+        if lo <= node_lo and node_hi <= hi:
+            self._add[node] += delta
+            self._min[node] += delta
+            return
+        mid = (node_lo + node_hi) // 2
+        self.add(lo, hi, delta, 2 * node, node_lo, mid)
+        self.add(lo, hi, delta, 2 * node + 1, mid, node_hi)
+        self._min[node] = self._add[node] + min(self._min[2 * node], self._min[2 * node + 1])
+
+class PackageInventory:
+    def __init__(self, first_day, remaining):
+        self.first_day = first_day
+        self.tree = CapacityTree(remaining)
+
+    def _span(self, start, end):
+        return (start - self.first_day).days, (end - self.first_day).days
+
+    def available(self, start, end, travelers):
+        lo, hi = self._span(start, end)
+        if lo < 0 or hi > self.tree.n:
+            return False
+        return self.tree.min(lo, hi) >= travelers
+
+    def reserve(self, start, end, travelers):
+        lo, hi = self._span(start, end)
+        self.tree.add(lo, hi, -travelers)
+
+    def remaining(self, day):
+        index = (day - self.first_day).days
+        if index < 0 or index >= self.tree.n:
+            return 0
+        return self.tree.min(index, index + 1)
+
+class InventoryIndex:
+    # Per-worker read cache of PackageInventory trees. Checkout re-checks the
+    # table under the write lock, so a tree only needs to be nearly fresh.
+    def __init__(self, ttl=5.0, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, package_id):
+        with pooled_connection(db_pool) as conn:
+            rows = conn.execute('''
+                SELECT day, capacity - reserved FROM package_inventory
+                WHERE package_id = ? ORDER BY day
+            ''', (package_id,)).fetchall()
+        if not rows:
+            return None
+        first_day = datetime.strptime(rows[0][0], '%Y-%m-%d').date()
+        last_day = datetime.strptime(rows[-1][0], '%Y-%m-%d').date()
+        remaining = [0] * ((last_day - first_day).days + 1)
+        for day, seats in rows:
+            remaining[(datetime.strptime(day, '%Y-%m-%d').date() - first_day).days] = seats
+        return PackageInventory(first_day, remaining)
+
+    def get(self, package_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(package_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(package_id)
+                return entry[1]
+        inventory = self._load(package_id)
+        with self._lock:
+            self._entries[package_id] = (now + self.ttl, inventory)
+            self._entries.move_to_end(package_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return inventory
+
+    def invalidate(self, package_id):
+        with self._lock:
+            self._entries.pop(package_id, None)
+
+inventory_index = InventoryIndex(app.config['INVENTORY_TTL'])
+
+def reserve_seats(cursor, package_id, check_in, check_out, travelers):
+    # Must run inside the checkout's IMMEDIATE transaction
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM package_inventory WHERE package_id = ?)',
+                   (package_id,))
+    if not cursor.fetchone()[0]:
+        return True
+    stay = stay_range(check_in, check_out)
+    if stay is None:
+        return False
+    start, end = stay
+    cursor.execute('''
+        SELECT COUNT(*), MIN(capacity - reserved) FROM package_inventory
+        WHERE package_id = ? AND day >= ? AND day < ?
+    ''', (package_id, start.isoformat(), end.isoformat()))
+    days, remaining = cursor.fetchone()
+    if days < (end - start).days or remaining < int(travelers):
+        return False
+    cursor.execute('''
+        UPDATE package_inventory SET reserved = reserved + ?
+        WHERE package_id = ? AND day >= ? AND day < ?
+    ''', (travelers, package_id, start.isoformat(), end.isoformat()))
+    return True
+
+def release_seats(cursor, package_id, check_in, check_out, travelers):
+    # Only for bookings with seats_held set: those took `travelers` seats on
+    # every day of the stay, so every day must be there to give them back
+    stay = stay_range(check_in, check_out)
+    if stay is None:
+        raise SeatAccountingError('package %s: invalid stay %s to %s' % (
+            package_id, check_in, check_out))
+    start, end = stay
     cursor.execute('''
+        UPDATE package_inventory SET reserved = reserved - ?
+        WHERE package_id = ? AND day >= ? AND day < ?
+        RETURNING reserved
+    ''', (travelers, package_id, start.isoformat(), end.isoformat()))
+    left = [row[0] for row in cursor.fetchall()]
+    if len(left) != (end - start).days or min(left) < 0:
+        raise SeatAccountingError('package %s: releasing %s seats from %s to %s leaves %s' % (
+            package_id, travelers, check_in, check_out, left))
+
+# Abandoned cart cleanup. Seats are only taken at checkout, so expiring a
+# cart row frees nothing in package_inventory; it just stops the table from
+# growing. Each batch is its own short transaction on a connection with a
+# small busy timeout, so the sweeper backs off instead of queueing behind
+# request writers. Unpaid checkout quotes are swept the same way.
+def _cutoff(ttl):
+    return (datetime.now(timezone.utc) - timedelta(seconds=ttl)).strftime('%Y-%m-%d %H:%M:%S')
+
+def expire_cart_rows(conn, ttl, batch_size=500):
+    return _delete_in_batches(conn, '''
+        DELETE FROM cart WHERE id IN (
+            SELECT id FROM cart WHERE created_at < ? ORDER BY created_at LIMIT ?
+        )
+    ''', _cutoff(ttl), batch_size)
+
+def expire_checkout_quotes(conn, ttl, batch_size=500):
+    return _delete_in_batches(conn, '''
+        DELETE FROM checkout_quotes WHERE token IN (
+            SELECT token FROM checkout_quotes WHERE created_at < ? ORDER BY created_at LIMIT ?
+        )
+    ''', _cutoff(ttl), batch_size)
+
+def _delete_in_batches(conn, sql, cutoff, batch_size, busy_pause=0.2, max_busy=50):
+    reclaimed = 0
+    busy = 0
+    while True:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            deleted = conn.execute(sql, (cutoff, batch_size)).rowcount
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            busy += 1
+            if busy >= max_busy:
+                break
+            time.sleep(busy_pause * random.uniform(0.5, 1.5))
+            continue
+        reclaimed += deleted
+        if deleted < batch_size:
+            break
+        # Let waiting writers in between batches
+        time.sleep(0)
+    return reclaimed
+
+class CartSweeper:
+    # Optional in-process sweeper, started on the first request of each
+    # worker when CART_SWEEP_INTERVAL is set.
+    def __init__(self, interval, ttl, batch_size):
+        self.interval = interval
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.reclaimed = 0
+        self.quotes = 0
+        self.runs = 0
+        self.failures = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='cart-sweeper', daemon=True).start()
+
+    def _run(self):
+        try:
+            conn = db_pool.connect()
+            conn.execute('PRAGMA busy_timeout = 50')
+            while True:
+                # Spread workers so they don't all sweep at the same moment
+                time.sleep(self.interval * random.uniform(0.8, 1.2))
+                try:
+                    self.reclaimed += expire_cart_rows(conn, self.ttl, self.batch_size)
+                    self.quotes += expire_checkout_quotes(conn, app.config['CHECKOUT_QUOTE_TTL'],
+                                                          self.batch_size)
+                    self.runs += 1
+                except Exception:
+                    # A failed sweep is retried on the next tick, never ends the thread
+                    self.failures += 1
+                    app.logger.exception('Cart sweep failed')
+                    if conn.in_transaction:
+                        conn.rollback()
+        except Exception:
+            app.logger.exception('Cart sweeper stopped')
+        finally:
+            # Let the next request of this worker start a new one
+            with self._lock:
+                self._pid = None
+
+    def stats(self):
+        return {'runs': self.runs, 'reclaimed': self.reclaimed, 'quotes': self.quotes,
+                'failures': self.failures}
+
+cart_sweeper = CartSweeper(app.config['CART_SWEEP_INTERVAL'], app.config['CART_TTL'],
+                           app.config['CART_SWEEP_BATCH'])
+
+@app.before_request
+def start_cart_sweeper():
+    if cart_sweeper.interval > 0:
+        cart_sweeper.start()
+
+# Post-checkout work. Views enqueue jobs (see jobs.py) in the transaction that
+# writes the booking and return; `flask --app app run-jobs` runs them in
+# separate processes next to gunicorn, as many as needed. Mail goes to
+# MailOutbox, a directory of .eml files standing in for an SMTP relay.
+class MailOutbox:
+    def __init__(self, directory, sender):
+        self.directory = directory
+        self.sender = sender
+        self.sent = 0
+
+    def send(self, to, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = to
+        message['Subject'] = subject
+        message['Date'] = formatdate(localtime=True)
+        message['Message-ID'] = make_msgid(domain=self.sender.rsplit('@', 1)[-1].rstrip('>'))
+        message.set_content(body)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '%d-%s.eml' % (time.time_ns(), secrets.token_hex(4)))
+        # Written under a temporary name so a reader never sees half a message
+        with open(path + '.tmp', 'wb') as f:
+            f.write(message.as_bytes())
+        os.replace(path + '.tmp', path)
+        self.sent += 1
+        return path
+
+outbox = MailOutbox(app.config['MAIL_OUTBOX'], app.config['MAIL_SENDER'])
+job_queue = jobs.JobQueue(run_transaction, app.config['JOB_LEASE'], app.config['JOB_MAX_ATTEMPTS'],
+                          app.config['JOB_BACKOFF'])
+
+def render_email(template, **context):
+    # Straight from the Jinja environment: the page context processors need a request
+    return app.jinja_env.get_template('emails/' + template).render(context)
+
+def send_booking_confirmation(conn, payload):
+    bookings = repository.batch_booking_emails(conn, payload['batch'])
+    if not bookings:
+        return
+    outbox.send(bookings[0].email, 'Reserva confirmada', render_email(
+        'booking_confirmation.txt', name=bookings[0].name, bookings=bookings,
+        total=sum(booking.total_price for booking in bookings),
+        installments=bookings[0].payment_installments))
+
+def send_booking_cancellation(conn, payload):
+    booking = repository.booking_email(conn, payload['booking_id'])
+    if booking is None:
+        return
+    outbox.send(booking.email, 'Reserva cancelada', render_email(
+        'booking_cancellation.txt', name=booking.name, booking=booking))
+
+JOB_HANDLERS = {
+    'booking_confirmation': send_booking_confirmation,
+    'booking_cancellation': send_booking_cancellation,
+}
+
+job_runs = registry.counter('jobs_processed_total', 'Jobs run by this process by outcome.',
+                            ('kind', 'outcome'))
+job_seconds = registry.histogram('job_duration_seconds', 'Time to run a job and record its outcome.',
+                                 ('kind',))
+
+def observe_job(kind, outcome, seconds):
+    job_runs.inc(kind, outcome)
+    job_seconds.observe(seconds, kind)
+
+def job_queue_state():
+    # Queue depth and how long the oldest due job has waited, read from the
+    # database so any process can report them
+    conn = db_pool.acquire()
+    try:
+        counts = job_queue.counts(conn)
+        lag = job_queue.lag(conn)
+    finally:
+        db_pool.release(conn)
+    return counts, {(): lag}
+
+# Both from one read per scrape, so they describe the same moment
+registry.gauge_set((('jobs', 'Jobs in the queue by status.', ('status', 'kind')),
+                    ('jobs_ready_lag_seconds', 'Time the oldest due job has been waiting.', ())),
+                   job_queue_state)
+
+def metrics_allowed(address, authorization, forwarded):
+    # /metrics names SQL statements and pool internals, so it is never
+    # public: with METRICS_TOKEN set scrapers send it as a bearer token,
+    # otherwise only direct connections from this host are served
+    token = app.config['METRICS_TOKEN']
+    if token:
+        return secrets.compare_digest((authorization or '').encode('utf-8'),
+                                      ('Bearer ' + token).encode('utf-8'))
+    if forwarded:
+        # Came through a proxy; the loopback address is the proxy's
+        return False
+    try:
+        ip = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+    return (getattr(ip, 'ipv4_mapped', None) or ip).is_loopback
+
+def serve_metrics(port):
+    # /metrics for processes outside gunicorn, such as the job worker
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not metrics_allowed(self.client_address[0], self.headers.get('Authorization'),
+                                   self.headers.get('X-Forwarded-For')):
+                self.send_error(403)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+# Bulk package import/export. Import rows go through the same checks as
+# PackageForm, read from the form's own field definitions, and are upserted
+# by id (rows without one are new) in executemany batches, one short
+# transaction per batch. Rows identical to the stored package are left alone,
+# so re-importing a season file only reindexes what changed. Bad rows are
+# reported by line and skipped. Exports page through the table by id, so
+# neither side holds a whole table in memory or keeps a read transaction open
+# for the length of the file.
+PACKAGE_IMPORT_COLUMNS = ('title', 'destination', 'description', 'price', 'duration', 'category',
+                          'image_url', 'includes', 'hotel', 'transport', 'featured')
+EXPORT_COLUMNS = {
+    'packages': ('id',) + PACKAGE_IMPORT_COLUMNS + ('created_at', 'updated_at'),
+    'bookings': ('id', 'user_id', 'package_id', 'travelers', 'check_in', 'check_out',
+                 'total_price', 'status', 'payment_method', 'payment_installments', 'created_at'),
+}
+IMPORT_ERRORS_KEPT = 1000
+# Spreadsheets run a cell starting with one of these as a formula. CSV
+# exports prefix such text with an apostrophe, which spreadsheets hide and
+# CSV imports strip again.
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r', "'")
+TRUE_VALUES = {'1', 'true', 'sim', 's', 'yes', 'y', 'on', 'x'}
+
+def _field_rules(form_class, names):
+    # (name, field class, required, allowed choices) per column
+    rules = []
+    for name in names:
+        field = getattr(form_class, name)
+        validators = field.kwargs.get('validators') or ()
+        choices = field.kwargs.get('choices')
+        rules.append((name, field.field_class,
+                      any(isinstance(v, DataRequired) for v in validators),
+                      frozenset(value for value, _ in choices) if choices else None))
+    return rules
+
+PACKAGE_RULES = _field_rules(PackageForm, PACKAGE_IMPORT_COLUMNS)
+
+# Import rows are (id, title, destination, description, price, duration,
+# category, image_url, includes, hotel, transport, featured). Existing ids
+# are updated in two statements so a price change doesn't fire the search
+# index trigger (UPDATE OF fires for every column in SET), and only when
+# something actually differs.
+PACKAGE_INSERT = '''
+    INSERT INTO packages (id, title, destination, description, price, duration, category,
+                          image_url, includes, hotel, transport, featured)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO NOTHING
+'''
+PACKAGE_UPDATE_TEXT = '''
+    UPDATE packages SET title = ?2, destination = ?3, description = ?4, includes = ?9, hotel = ?10
+    WHERE id = ?1 AND (title, destination, description, includes, hotel) IS NOT (?2, ?3, ?4, ?9, ?10)
+'''
+PACKAGE_UPDATE_DETAILS = '''
+    UPDATE packages SET price = ?5, duration = ?6, category = ?7, image_url = ?8,
+                        transport = ?11, featured = ?12
+    WHERE id = ?1
+      AND (price, duration, category, image_url, transport, featured) IS NOT (?5, ?6, ?7, ?8, ?11, ?12)
+'''
+
+def _coerce(field_class, value):
+    if field_class is BooleanField:
+        return value if isinstance(value, bool) else str(value or '').strip().lower() in TRUE_VALUES
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == '':
+        return None
+    if field_class is FloatField:
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError(value)
+        return value
+    if field_class is IntegerField:
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(value)
+        return int(value)
+    return str(value)
+
+def clean_package_row(row):
+    # Returns (values for PACKAGE_INSERT, None) or (None, error message)
+    try:
+        package_id = _coerce(IntegerField, row.get('id'))
+    except (TypeError, ValueError):
+        package_id = 0
+    if package_id is not None and package_id < 1:
+        return None, 'id: valor inválido %r' % row.get('id')
+    values = [package_id]
+    for name, field_class, required, choices in PACKAGE_RULES:
+        try:
+            value = _coerce(field_class, row.get(name))
+        except (TypeError, ValueError):
+            return None, '%s: valor inválido %r' % (name, row.get(name))
+        if required and not value:
+            return None, '%s: campo obrigatório' % name
+        if choices is not None and value not in choices:
+            return None, '%s: opção inválida %r' % (name, value)
+        values.append(value)
+    return tuple(values), None
+
+def csv_cell(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def csv_uncell(value):
+    if isinstance(value, str) and value[:1] == "'" and value[1:].startswith(CSV_FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+def file_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def read_import_rows(stream, fmt):
+    # Yields (line number, row dict or None, error) from a binary stream
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {k: csv_uncell(v) for k, v in row.items()}, None
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, 'JSON inválido'
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'esperado um objeto JSON'
+            continue
+        yield number, row, None
+
+def import_package_rows(conn, stream, fmt, batch_size=5000):
+    report = {'rows': 0, 'imported': 0, 'failed': 0, 'errors': []}
+    batch = []
+    
+    def reject(line, error):
+        report['failed'] += 1
+        if len(report['errors']) < IMPORT_ERRORS_KEPT:
+            report['errors'].append((line, error))
+    
+    def write(cursor):
+        cursor.executemany(PACKAGE_INSERT, batch)
+        existing = [values for values in batch if values[0] is not None]
+        
+        def update():
+            cursor.executemany(PACKAGE_UPDATE_TEXT, [values[:10] for values in existing])
+            cursor.executemany(PACKAGE_UPDATE_DETAILS, existing)
+        restate_package_stats(cursor, [values[0] for values in existing], update)
+    
+    def flush():
+        run_transaction(conn, write)
+        report['imported'] += len(batch)
+        del batch[:]
+    
+    try:
+        try:
+            for line, row, error in read_import_rows(stream, fmt):
+                report['rows'] += 1
+                if error is None:
+                    values, error = clean_package_row(row)
+                if error is not None:
+                    reject(line, error)
+                    continue
+                batch.append(values)
+                if len(batch) >= batch_size:
+                    flush()
+        except (UnicodeDecodeError, csv.Error) as e:
+            # Rows before the unreadable part are still imported
+            reject(None, 'arquivo ilegível: %s' % e)
+        if batch:
+            flush()
+    finally:
+        # One invalidation for the whole file, not one per row
+        if report['imported']:
+            catalog.invalidate()
+    return report
+
+def export_pages(conn, table, page_size=1000):
+    columns = EXPORT_COLUMNS[table]
+    sql = 'SELECT %s FROM %s WHERE id > ? ORDER BY id LIMIT ?' % (', '.join(columns), table)
+    last = 0
+    while True:
+        rows = conn.execute(sql, (last, page_size)).fetchall()
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1][0]
+
+def export_lines(conn, table, fmt):
+    # Yields the file in chunks of one page each
+    columns = EXPORT_COLUMNS[table]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in export_pages(conn, table):
+            writer.writerows([csv_cell(value) for value in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+    for rows in export_pages(conn, table):
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False,
+                                 separators=(',', ':')) + '\n' for row in rows)
+
+# Schema migrations, applied in order and tracked in PRAGMA user_version.
+# A step is a list of SQL statements or callables taking the connection.
+# Never edit a shipped migration; append a new one instead.
+MIGRATIONS = [
+    # 1: base tables
+    [
+        '''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             email TEXT UNIQUE NOT NULL,
@@ -64,10 +1449,8 @@ def init_db():
             is_admin BOOLEAN DEFAULT FALSE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Packages table
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS packages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
@@ -83,10 +1466,8 @@ def init_db():
             featured BOOLEAN DEFAULT FALSE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Bookings table
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS bookings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
@@ -102,10 +1483,8 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id),
             FOREIGN KEY (package_id) REFERENCES packages (id)
         )
-    ''')
-    
-    # Cart table
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS cart (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
@@ -117,7 +1496,236 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id),
             FOREIGN KEY (package_id) REFERENCES packages (id)
         )
-    ''')
+        ''',
+    ],
+    # 2: full-text index over packages, kept in sync by triggers
+    [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS packages_fts USING fts5(
+            title, destination, description, includes, hotel,
+            content='packages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS packages_fts_ai AFTER INSERT ON packages BEGIN
+            INSERT INTO packages_fts (rowid, title, destination, description, includes, hotel)
+            VALUES (new.id, new.title, new.destination, new.description, new.includes, new.hotel);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS packages_fts_ad AFTER DELETE ON packages BEGIN
+            INSERT INTO packages_fts (packages_fts, rowid, title, destination, description, includes, hotel)
+            VALUES ('delete', old.id, old.title, old.destination, old.description, old.includes, old.hotel);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS packages_fts_au
+        AFTER UPDATE OF title, destination, description, includes, hotel ON packages BEGIN
+            INSERT INTO packages_fts (packages_fts, rowid, title, destination, description, includes, hotel)
+            VALUES ('delete', old.id, old.title, old.destination, old.description, old.includes, old.hotel);
+            INSERT INTO packages_fts (rowid, title, destination, description, includes, hotel)
+            VALUES (new.id, new.title, new.destination, new.description, new.includes, new.hotel);
+        END
+        ''',
+        "INSERT INTO packages_fts (packages_fts) VALUES ('rebuild')",
+    ],
+    # 3: indexes for the route queries; cart rows become unique per package
+    [
+        '''
+        DELETE FROM cart WHERE id NOT IN (
+            SELECT MAX(id) FROM cart GROUP BY user_id, package_id
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_user_package ON cart (user_id, package_id)',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_user_created ON bookings (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_status_total ON bookings (status, total_price)',
+        'CREATE INDEX IF NOT EXISTS idx_packages_created ON packages (created_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_users_is_admin ON users (is_admin)',
+    ],
+    # 4: incrementally maintained dashboard aggregates
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS booking_stats (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        rebuild_stats,
+    ],
+    # 5: idempotent checkout batches
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS checkout_batches (
+            token TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            bookings INTEGER NOT NULL,
+            total_price REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        'ALTER TABLE bookings ADD COLUMN batch_token TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_batch ON bookings (batch_token)',
+    ],
+    # 6: package modification time for Last-Modified headers
+    [
+        'ALTER TABLE packages ADD COLUMN updated_at TIMESTAMP',
+        '''
+        CREATE TRIGGER IF NOT EXISTS packages_touch AFTER UPDATE ON packages BEGIN
+            UPDATE packages SET updated_at = CURRENT_TIMESTAMP WHERE id = new.id;
+        END
+        ''',
+    ],
+    # 7: keyset pagination by price
+    [
+        'CREATE INDEX IF NOT EXISTS idx_packages_price ON packages (price, id)',
+        'CREATE INDEX IF NOT EXISTS idx_packages_category_price ON packages (category, price, id)',
+    ],
+    # 8: per-day seat inventory
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS package_inventory (
+            package_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            capacity INTEGER NOT NULL,
+            reserved INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (package_id, day),
+            FOREIGN KEY (package_id) REFERENCES packages (id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    # 9: cart expiry sweeps by age
+    [
+        'CREATE INDEX IF NOT EXISTS idx_cart_created ON cart (created_at)',
+    ],
+    # 10: short description for listing cards, so they never read the full text
+    [
+        'ALTER TABLE packages ADD COLUMN summary TEXT',
+        '''
+        CREATE TRIGGER IF NOT EXISTS packages_summary_ai AFTER INSERT ON packages BEGIN
+            UPDATE packages SET summary = CASE WHEN length(new.description) > 100
+                THEN rtrim(substr(new.description, 1, 100)) || '...' ELSE new.description END
+            WHERE id = new.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS packages_summary_au AFTER UPDATE OF description ON packages BEGIN
+            UPDATE packages SET summary = CASE WHEN length(new.description) > 100
+                THEN rtrim(substr(new.description, 1, 100)) || '...' ELSE new.description END
+            WHERE id = new.id;
+        END
+        ''',
+        '''
+        UPDATE packages SET summary = CASE WHEN length(description) > 100
+            THEN rtrim(substr(description, 1, 100)) || '...' ELSE description END
+        ''',
+    ],
+    # 11: prices locked at checkout until payment
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS checkout_quotes (
+            token TEXT NOT NULL,
+            package_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            travelers INTEGER NOT NULL,
+            check_in DATE NOT NULL,
+            check_out DATE NOT NULL,
+            unit_price REAL NOT NULL,
+            total_price REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (token, package_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_checkout_quotes_created ON checkout_quotes (created_at)',
+    ],
+    # 12: booking history filtered by status, upcoming trip counts, and the
+    # per-user stats scope
+    [
+        'CREATE INDEX IF NOT EXISTS idx_bookings_user_status_created ON bookings (user_id, status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_bookings_user_status_check_in ON bookings (user_id, status, check_in)',
+        rebuild_stats,
+    ],
+    # 13: job queue (jobs.py); run_at is when a queued job is due or a
+    # running job's lease expires
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            run_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            lease TEXT,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs (status, run_at)',
+    ],
+    # 14: a package's bookings, to restate its stats when it is edited or deleted
+    [
+        'CREATE INDEX IF NOT EXISTS idx_bookings_package_status ON bookings (package_id, status)',
+    ],
+    # 15: each user's open checkout quote
+    [
+        'CREATE INDEX IF NOT EXISTS idx_checkout_quotes_user ON checkout_quotes (user_id, created_at)',
+    ],
+    # 16: whether a booking took seats from package_inventory, so cancelling
+    # it only gives back seats it actually reserved. Existing confirmed
+    # bookings are assumed to hold seats when inventory covers their whole stay.
+    [
+        'ALTER TABLE bookings ADD COLUMN seats_held INTEGER NOT NULL DEFAULT 0',
+        '''
+        UPDATE bookings SET seats_held = 1
+        WHERE status = 'confirmed' AND max(julianday(check_out) - julianday(check_in), 1) = (
+            SELECT COUNT(*) FROM package_inventory i
+            WHERE i.package_id = bookings.package_id AND i.day >= bookings.check_in
+              AND i.day < max(bookings.check_out, date(bookings.check_in, '+1 day'))
+        )
+        ''',
+    ],
+]
+
+def migrate(conn):
+    # Each migration runs in its own IMMEDIATE transaction and re-reads the
+    # version inside it, so workers starting together apply it exactly once.
+    applied = []
+    for number, statements in enumerate(MIGRATIONS, start=1):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= number:
+                conn.rollback()
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute('PRAGMA user_version = %d' % number)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(number)
+    return applied
+
+# Database initialization
+def init_db():
+    conn = db_pool.connect()
+    migrate(conn)
+    cursor = conn.cursor()
     
     # Insert sample data
     cursor.execute('SELECT COUNT(*) FROM packages')
@@ -143,7 +1751,7 @@ def init_db():
     # Create admin user
     cursor.execute('SELECT COUNT(*) FROM users WHERE email = ?', ('admin@cvc.com',))
     if cursor.fetchone()[0] == 0:
-        admin_password = generate_password_hash('admin123')
+        admin_password = generate_password_hash('admin123', app.config['PASSWORD_METHOD'])
         cursor.execute('''
             INSERT INTO users (email, password_hash, name, is_admin)
             VALUES (?, ?, ?, ?)
@@ -152,88 +1760,675 @@ def init_db():
     conn.commit()
     conn.close()
 
-# User class for Flask-Login
-class User(UserMixin):
-    def __init__(self, id, email, name, is_admin=False):
-        self.id = id
-        self.email = email
-        self.name = name
-        self.is_admin = is_admin
+# Query plan check: every SQL literal executed inside a view must be served
+# by an index. Run `flask --app app check-query-plans` before shipping.
+def _is_view_decorator(node):
+    if isinstance(node, ast.Call):
+        node = node.func
+    return isinstance(node, ast.Attribute) and node.attr in ('route', 'user_loader')
+
+def view_queries():
+    # Views in this file, plus every query in the repository module
+    for path, views_only in ((__file__, True), (repository.__file__, False)):
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read())
+        for func in ast.walk(tree):
+            if not isinstance(func, ast.FunctionDef):
+                continue
+            if views_only and not any(_is_view_decorator(d) for d in func.decorator_list):
+                continue
+            yield from _execute_literals(func)
+
+def _execute_literals(func):
+    for node in ast.walk(func):
+        if not isinstance(node, ast.Call):
+            continue
+        if isinstance(node.func, ast.Attribute) and node.func.attr == 'execute':
+            args = node.args[:1]
+        elif isinstance(node.func, ast.Name) and node.func.id == '_records':
+            args = node.args[2:3]
+        else:
+            continue
+        for arg in args:
+            if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                yield func.name, arg.value
+
+class _RecordingConnection:
+    # Stands in for a connection to collect the SQL a query builder runs
+    row_factory = None
+
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+        return self
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return (0,)
+
+    def __iter__(self):
+        return iter(())
+
+def dynamic_queries():
+    # Builders assemble SQL from request options, so it never appears as one
+    # literal; each one is run here for every shape it can produce
+    history = _RecordingConnection()
+    for status in (None,) + repository.BOOKING_STATUSES:
+        for when in (None,) + tuple(repository.BOOKING_WHEN):
+            for after in (None, ['', 0]):
+                repository.booking_history(history, 0, status, when, after)
+    search = _RecordingConnection()
+    api_search_sql = []
+    for q, category, min_price, max_price in itertools.product(
+            ('', 'x'), ('', 'praia'), ('', '0'), ('', '0')):
+        args = {'q': q, 'category': category, 'min_price': min_price, 'max_price': max_price}
+        # A non-zero offset records the count query as well
+        search_package_page(search, 'x', category, _parse_price(min_price),
+                            _parse_price(max_price), offset=1)
+        for after in (None, [0.0, 0]):
+            api_search_sql.append(package_search_query(args, after, 1)[0])
+    queries = [('booking_history', sql) for sql in history.statements]
+    queries += [('search_package_page', sql) for sql in search.statements]
+    queries += [('api_packages', package_list_query(after, 1)[0]) for after in (None, ['', 0])]
+    queries += [('api_search', sql) for sql in api_search_sql]
+    seen = set()
+    for name, sql in queries:
+        if sql not in seen:
+            seen.add(sql)
+            yield name, sql
+
+def check_query_plans(conn):
+    problems = []
+    for view, sql in itertools.chain(view_queries(), dynamic_queries()):
+        params = (None,) * sql.count('?')
+        try:
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        except sqlite3.Error as e:
+            problems.append((view, str(e), ' '.join(sql.split())))
+            continue
+        for row in plan:
+            detail = row[3]
+            # Scans of materialized subqueries (window functions) read rows
+            # that were already found through an index
+            if (detail.startswith('SCAN ') and 'USING' not in detail
+                    and 'VIRTUAL TABLE' not in detail and detail != 'SCAN CONSTANT ROW'
+                    and not detail.startswith('SCAN (subquery')):
+                problems.append((view, detail, ' '.join(sql.split())))
+    return problems
+
+@app.cli.command('init-db')
+def init_db_command():
+    init_db()
+    click.echo('Database ready at %s' % app.config['DATABASE'])
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    conn = db_pool.connect()
+    migrate(conn)
+    problems = check_query_plans(conn)
+    conn.close()
+    for view, detail, sql in problems:
+        click.echo('%s: %s\n    %s' % (view, detail, sql), err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo('All view queries use an index.')
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    conn = db_pool.connect()
+    conn.execute('BEGIN IMMEDIATE')
+    before = {row[:2]: row[2:] for row in conn.execute('SELECT * FROM booking_stats')}
+    rebuild_stats(conn)
+    after = {row[:2]: row[2:] for row in conn.execute('SELECT * FROM booking_stats')}
+    conn.commit()
+    conn.close()
+    drifted = 0
+    for key in sorted(set(before) | set(after)):
+        old, new = before.get(key, (0, 0)), after.get(key, (0, 0))
+        if old[0] != new[0] or abs(old[1] - new[1]) > 0.005:
+            drifted += 1
+            click.echo('%s/%s: %s -> %s' % (key[0], key[1], old, new))
+    click.echo('Rebuilt %d stats rows, %d had drifted.' % (len(after), drifted))
+
+@app.cli.command('refresh-replicas', help='Copy the primary over every DATABASE_REPLICAS file.')
+@click.option('--interval', type=float, default=0,
+              help='Keep refreshing every INTERVAL seconds (default: once).')
+def refresh_replicas_command(interval):
+    paths = app.config['DATABASE_REPLICAS']
+    if not paths:
+        raise click.UsageError('DATABASE_REPLICAS is not set')
+    source = db_pool.connect()
+    try:
+        while True:
+            started = time.perf_counter()
+            refresh_replicas(source, paths)
+            elapsed = time.perf_counter() - started
+            click.echo('Refreshed %d replicas in %.2fs.' % (len(paths), elapsed))
+            if interval <= 0:
+                break
+            time.sleep(max(0.0, interval - elapsed))
+    finally:
+        source.close()
+
+@app.cli.command('expire-carts')
+@click.option('--ttl', type=float, default=None, help='Age in seconds (default: CART_TTL).')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction.')
+def expire_carts_command(ttl, batch_size):
+    conn = db_pool.connect()
+    conn.execute('PRAGMA busy_timeout = 50')
+    batch_size = batch_size or app.config['CART_SWEEP_BATCH']
+    reclaimed = expire_cart_rows(conn, app.config['CART_TTL'] if ttl is None else ttl, batch_size)
+    quotes = expire_checkout_quotes(conn, app.config['CHECKOUT_QUOTE_TTL'], batch_size)
+    conn.close()
+    click.echo('Expired %d cart rows and %d checkout quote rows.' % (reclaimed, quotes))
+
+@app.cli.command('run-jobs', help='Run queued jobs until stopped (SIGTERM or Ctrl-C).')
+@click.option('--batch', type=int, default=None, help='Jobs claimed per transaction (default: JOB_BATCH).')
+@click.option('--poll', type=float, default=None,
+              help='Seconds between polls of an empty queue (default: JOB_POLL).')
+@click.option('--once', is_flag=True, help='Run the jobs that are due, then exit.')
+@click.option('--metrics-port', type=int, default=0, help='Serve this worker\'s /metrics on PORT.')
+def run_jobs_command(batch, poll, once, metrics_port):
+    conn = db_pool.connect()
+    worker = jobs.Worker(job_queue, conn, JOB_HANDLERS, batch or app.config['JOB_BATCH'],
+                         app.config['JOB_POLL'] if poll is None else poll, observe_job)
+    # Finish the job in hand; the rest of the batch is retried after its lease
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    if metrics_port:
+        serve_metrics(metrics_port)
+    started = time.perf_counter()
+    try:
+        if once:
+            while worker.run_once() and not worker.stopping.is_set():
+                pass
+        else:
+            worker.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    processed = worker.processed
+    total = sum(processed.values())
+    click.echo('Ran %d jobs in %.1fs (%.1f/s): %d done, %d retried, %d dead, %d lost leases.' % (
+        total, elapsed, total / elapsed if elapsed else 0.0, processed['done'], processed['retry'],
+        processed['dead'], processed['lost']))
+
+@app.cli.command('jobs', help='Show queued, running and dead jobs by kind.')
+@click.option('--requeue-dead', is_flag=True, help='Queue dead jobs again with fresh attempts.')
+@click.option('--kind', default=None, help='Only requeue jobs of this kind.')
+def jobs_command(requeue_dead, kind):
+    conn = db_pool.connect()
+    if requeue_dead:
+        click.echo('Requeued %d dead jobs.' % job_queue.requeue_dead(conn, kind))
+    for (status, job_kind), count in sorted(job_queue.counts(conn).items()):
+        click.echo('%-8s %-24s %d' % (status, job_kind, count))
+    click.echo('Oldest due job waiting %.1fs.' % job_queue.lag(conn))
+    for job_id, job_kind, attempts, error in conn.execute('''
+        SELECT id, kind, attempts, last_error FROM jobs WHERE status = 'dead' ORDER BY id DESC LIMIT 5
+    '''):
+        click.echo('dead #%d %s after %d attempts: %s' % (
+            job_id, job_kind, attempts, ((error or '').strip().splitlines() or [''])[-1]))
+    conn.close()
+
+@app.cli.command('set-inventory',
+                 help='Sell CAPACITY seats per day of PACKAGE_ID from START to END (inclusive).')
+@click.argument('package_id', type=int)
+@click.argument('start')
+@click.argument('end')
+@click.argument('capacity', type=int)
+def set_inventory_command(package_id, start, end, capacity):
+    first = datetime.strptime(start, '%Y-%m-%d').date()
+    last = datetime.strptime(end, '%Y-%m-%d').date()
+    days = [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+    conn = db_pool.connect()
+    conn.executemany('''
+        INSERT INTO package_inventory (package_id, day, capacity) VALUES (?, ?, ?)
+        ON CONFLICT (package_id, day) DO UPDATE SET capacity = excluded.capacity
+    ''', [(package_id, day, capacity) for day in days])
+    conn.commit()
+    conn.close()
+    click.echo('Package %d: %d seats/day on %d days.' % (package_id, capacity, len(days)))
+
+@app.cli.command('import-packages', help='Upsert packages from a CSV or JSON Lines file.')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=5000, help='Rows per transaction.')
+def import_packages_command(path, batch_size):
+    conn = db_pool.connect()
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        report = import_package_rows(conn, f, file_format(path), batch_size)
+    conn.close()
+    for line, error in report['errors']:
+        click.echo('line %s: %s' % (line if line is not None else '-', error), err=True)
+    click.echo('Imported %d of %d rows in %.1fs, %d rejected.' % (
+        report['imported'], report['rows'], time.perf_counter() - started, report['failed']))
+    if report['failed']:
+        raise SystemExit(1)
+
+@app.cli.command('export', help='Write TABLE to PATH as CSV or JSON Lines ("-" for stdout).')
+@click.argument('table', type=click.Choice(sorted(EXPORT_COLUMNS)))
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Default: from the file extension.')
+def export_command(table, path, fmt):
+    conn = db_pool.connect()
+    with click.open_file(path, 'wb') as out:
+        for chunk in export_lines(conn, table, fmt or file_format(path)):
+            out.write(chunk.encode('utf-8'))
+    conn.close()
+
+# Password hashing and login throttling. Hashes run in worker processes (see
+# passwords.py) so a burst of logins can't starve catalog requests. Workers
+# are spawned, which re-imports __main__: scripts that log users in need an
+# `if __name__ == '__main__':` guard, or PASSWORD_WORKERS=0 to hash inline. The
+# limiters live in each worker: with N gunicorn workers an address gets up to
+# N times LOGIN_IP_LIMIT attempts per window.
+hasher = passwords.PasswordHasher(app.config['PASSWORD_METHOD'], app.config['PASSWORD_WORKERS'],
+                                  app.config['PASSWORD_QUEUE'], app.config['PASSWORD_TIMEOUT'])
+ip_limiter = passwords.SlidingWindowLimiter(app.config['LOGIN_IP_LIMIT'],
+                                            app.config['LOGIN_RATE_WINDOW'])
+email_limiter = passwords.SlidingWindowLimiter(app.config['LOGIN_EMAIL_LIMIT'],
+                                               app.config['LOGIN_RATE_WINDOW'])
+login_rejections = registry.counter('login_rejected_total',
+                                    'Login and register attempts refused before hashing.',
+                                    ('reason',))
+registry.gauge('password_hash_jobs', 'Password hashes running or queued in this worker.', (),
+               lambda: {(): hasher.in_flight})
+
+def throttle_login(template, email=None):
+    # An address over its limit doesn't count against the email's budget, so
+    # one client can't lock other people out by cycling through addresses
+    if not ip_limiter.hit(request.remote_addr):
+        reason = 'ip'
+    elif email is not None and not email_limiter.hit(email.strip().lower()):
+        reason = 'email'
+    else:
+        return None
+    login_rejections.inc(reason)
+    flash('Muitas tentativas. Aguarde um minuto e tente novamente.', 'error')
+    return (render_template(template), 429,
+            {'Retry-After': str(int(app.config['LOGIN_RATE_WINDOW']))})
+
+def hasher_busy(template):
+    login_rejections.inc('busy')
+    flash('Muitos acessos no momento. Tente novamente em instantes.', 'error')
+    return render_template(template), 503, {'Retry-After': '1'}
+
+def store_rehash(user_id, old_hash, future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        # Runs inline during the login when there are no hasher workers
+        with pooled_connection(db_pool) as conn:
+            try:
+                # Only replace the hash that was just verified; a password change wins
+                conn.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                             (future.result(), user_id, old_hash))
+                conn.commit()
+            except sqlite3.OperationalError:
+                conn.rollback()
+    except PoolTimeout:
+        pass
+
+def rehash_later(user_id, old_hash, password):
+    # Upgrade hashes made with an older PASSWORD_METHOD without making the
+    # login wait; when the pool is busy the next login tries again
+    if not hasher.needs_rehash(old_hash):
+        return
+    try:
+        future = hasher.hash_later(password)
+    except passwords.HasherBusy:
+        return
+    future.add_done_callback(functools.partial(store_rehash, user_id, old_hash))
+
+# Logged-in users, cached per worker so load_user skips the users table
+class UserCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.session_hits = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[user_id]
+            self.misses += 1
+        return None
+
+    def put(self, user):
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'session_hits': self.session_hits,
+        }
+
+user_cache = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+def remember_user(user):
+    user_cache.put(user)
+    if app.config['USER_SESSION_CACHE']:
+        session['user'] = [user.id, user.email, user.name, bool(user.is_admin), time.time()]
+
+def forget_user(user_id):
+    # Other workers drop their copy when USER_CACHE_TTL runs out
+    user_cache.invalidate(user_id)
+    session.pop('user', None)
+    session.pop('cart_count', None)
+
+# Cart badge count, kept in the signed session so every worker sees the same
+# value; cart writes drop it and the next render recounts.
+def get_cart_count():
+    cached = session.get('cart_count')
+    if cached and time.time() - cached[1] < app.config['CART_COUNT_TTL']:
+        return cached[0]
+    cursor = get_db().execute('SELECT COUNT(*) FROM cart WHERE user_id = ?', (current_user.id,))
+    count = cursor.fetchone()[0]
+    session['cart_count'] = [count, time.time()]
+    return count
+
+def invalidate_cart():
+    # Every cart write gets a new version, so cached summaries in any worker
+    # stop matching this session
+    session.pop('cart_count', None)
+    session['cart_version'] = secrets.token_hex(4)
+
+# Cart summaries per user, keyed by the session's cart version and the
+# catalog stamp so a cart write or an admin price edit recomputes them.
+class CartSummaryCache:
+    def __init__(self, ttl=300, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, version, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now and entry[1] == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        summary = load()
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, version, summary)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return summary
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+cart_summaries = CartSummaryCache(app.config['CART_SUMMARY_TTL'])
+
+def get_cart_summary():
+    version = (session.get('cart_version'), catalog.get().stamp)
+    return cart_summaries.get(current_user.id, version,
+                              lambda: repository.cart_summary(get_db(), current_user.id))
+
+@app.context_processor
+def inject_cart_count():
+    if current_user.is_authenticated:
+        return {'cart_count': get_cart_count()}
+    return {'cart_count': 0}
 
 @login_manager.user_loader
 def load_user(user_id):
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-    user_data = cursor.fetchone()
-    conn.close()
+    user_id = int(user_id)
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    
+    # Fields carried in the signed session cookie are trusted for one TTL
+    cached = session.get('user') if app.config['USER_SESSION_CACHE'] else None
+    if cached and cached[0] == user_id and time.time() - cached[4] < user_cache.ttl:
+        user_cache.session_hits += 1
+        user = User(*cached[:4])
+        user_cache.put(user)
+        return user
     
-    if user_data:
-        return User(user_data[0], user_data[1], user_data[3], user_data[5])
-    return None
+    user = repository.get_user(get_db(), user_id)
+    if user:
+        remember_user(user)
+    return user
 
 # Routes
 @app.route('/')
+@cached_page
 def home():
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    
-    # Get featured packages
-    cursor.execute('SELECT * FROM packages WHERE featured = 1 ORDER BY created_at DESC LIMIT 6')
-    featured_packages = cursor.fetchall()
-    
-    # Get all packages
-    cursor.execute('SELECT * FROM packages ORDER BY created_at DESC')
-    all_packages = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('home.html', featured_packages=featured_packages, all_packages=all_packages)
+    return render_template('home.html', featured_packages=catalog.get().featured)
 
-@app.route('/search')
-def search():
-    destination = request.args.get('destination', '')
-    category = request.args.get('category', '')
-    min_price = request.args.get('min_price', '')
-    max_price = request.args.get('max_price', '')
-    
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    
-    query = 'SELECT * FROM packages WHERE 1=1'
-    params = []
-    
-    if destination:
-        query += ' AND (destination LIKE ? OR title LIKE ?)'
-        params.extend([f'%{destination}%', f'%{destination}%'])
-    
+def _parse_price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+# Keyset pagination. Cursors are opaque url-safe tokens holding the sort key
+# of the last row served, so pages stay stable while packages are added.
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+# Value types of each kind of cursor
+LISTING_CURSOR = (str, int)
+PRICE_CURSOR = (float, int)
+OFFSET_CURSOR = (int,)
+
+def decode_cursor(token, types):
+    # Cursors come back from the client, so anything that is not a list of
+    # values of `types` (ints count as floats) is treated as no cursor rather
+    # than reaching comparisons or SQL parameters
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    for value, kind in zip(values, types):
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, int):
+            # SQLite integers are 64-bit
+            if kind is str or not -2 ** 63 <= value < 2 ** 63:
+                return None
+        elif not isinstance(value, kind) or (kind is float and not math.isfinite(value)):
+            return None
+    return values
+
+def page_size(default, maximum=100):
+    try:
+        size = int(request.args.get('per_page', default))
+    except ValueError:
+        return default
+    return max(1, min(size, maximum))
+
+def listing_key(package):
+    return (package.created_at or '', package.id)
+
+def price_key(package):
+    return (package.price, package.id)
+
+def seek_page(rows, key, cursor, per_page, descending=False):
+    # rows are sorted by key; binary search for the first row after cursor
+    start = 0
+    if cursor is not None:
+        cursor = tuple(cursor)
+        hi = len(rows)
+        while start < hi:
+            mid = (start + hi) // 2
+            k = key(rows[mid])
+            if (k >= cursor) if descending else (k <= cursor):
+                start = mid + 1
+            else:
+                hi = mid
+    page = rows[start:start + per_page]
+    next_cursor = None
+    if page and start + per_page < len(rows):
+        next_cursor = encode_cursor(*key(page[-1]))
+    return page, next_cursor
+
+def next_page_url(next_cursor):
+    if not next_cursor:
+        return None
+    args = request.args.to_dict()
+    args['cursor'] = next_cursor
+    return url_for(request.endpoint, **args)
+
+class StreamedPage:
+    # A keyset page read from a cursor while the template iterates it. The
+    # query asks for one extra row; next_url is set once the loop has run.
+    def __init__(self, rows, per_page, key):
+        self._rows = rows
+        self.per_page = per_page
+        self.key = key
+        self.next_url = None
+
+    def __iter__(self):
+        last = None
+        for count, row in enumerate(self._rows):
+            if count == self.per_page:
+                self.next_url = next_page_url(encode_cursor(*self.key(last)))
+                break
+            last = row
+            yield row
+
+def buffered(chunks, size=8192):
+    # Jinja yields many small strings; send them in larger pieces
+    pending = []
+    length = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(pending)
+            pending = []
+            length = 0
+    if pending:
+        yield ''.join(pending)
+
+# Column weights for bm25(): title, destination, description, includes, hotel
+SEARCH_WEIGHTS = (10.0, 8.0, 1.0, 2.0, 3.0)
+
+def fts_query(text):
+    # Every word becomes a quoted prefix term, so user input can never be
+    # parsed as FTS5 syntax and "canc" still finds "Cancún".
+    terms = re.findall(r'\w+', text)
+    return ' '.join('"%s"*' % term for term in terms)
+
+def search_package_page(conn, text, category=None, min_price=None, max_price=None,
+                        offset=0, limit=24):
+    # (ids in BM25 order, total matches) for one page of a text search with
+    # its filters, or None when the text has no words to search for
+    query = fts_query(text)
+    if not query:
+        return None
+    source = 'packages_fts'
+    where = 'packages_fts MATCH ?'
+    params = [query]
     if category:
-        query += ' AND category = ?'
+        where += ' AND p.category = ?'
         params.append(category)
-    
-    if min_price:
-        query += ' AND price >= ?'
+    if min_price is not None:
+        where += ' AND p.price >= ?'
         params.append(min_price)
-    
-    if max_price:
-        query += ' AND price <= ?'
+    if max_price is not None:
+        where += ' AND p.price <= ?'
         params.append(max_price)
+    if len(params) > 1:
+        # The triggers keep packages_fts in step with packages, so only the
+        # filters need the join
+        source += ' JOIN packages p ON p.id = packages_fts.rowid'
+    ids = [row[0] for row in conn.execute('''
+        SELECT packages_fts.rowid FROM %s
+        WHERE %s
+        ORDER BY bm25(packages_fts, ?, ?, ?, ?, ?)
+        LIMIT ? OFFSET ?
+    ''' % (source, where), params + list(SEARCH_WEIGHTS) + [limit, offset])]
+    if offset == 0 and len(ids) < limit:
+        return ids, len(ids)
+    total = conn.execute('SELECT COUNT(*) FROM %s WHERE %s' % (source, where), params).fetchone()[0]
+    return ids, total
+
+@app.route('/search')
+@cached_page
+def search():
+    destination = request.args.get('destination', '').strip()
+    category = request.args.get('category', '')
+    min_price = _parse_price(request.args.get('min_price'))
+    max_price = _parse_price(request.args.get('max_price'))
+    per_page = page_size(24)
     
-    query += ' ORDER BY price ASC'
+    snapshot = catalog.get()
+    start = 0
+    if destination:
+        # Relevance scores are not a stable sort key, so ranked results page by position
+        start = max(0, (decode_cursor(request.args.get('cursor'), OFFSET_CURSOR) or [0])[0])
+    ranked = search_package_page(get_db(), destination, category, min_price, max_price,
+                                 start, per_page) if destination else None
     
-    cursor.execute(query, params)
-    packages = cursor.fetchall()
-    conn.close()
+    if ranked is not None:
+        ids, total = ranked
+        # Ids deleted since the snapshot was taken drop out
+        page = [snapshot.by_id[i] for i in ids if i in snapshot.by_id]
+        next_cursor = encode_cursor(start + per_page) if start + per_page < total else None
+    else:
+        packages = snapshot.by_price
+        if category:
+            packages = [p for p in packages if p.category == category]
+        if min_price is not None:
+            packages = [p for p in packages if p.price >= min_price]
+        if max_price is not None:
+            packages = [p for p in packages if p.price <= max_price]
+        total = len(packages)
+        page, next_cursor = seek_page(packages, price_key,
+                                      decode_cursor(request.args.get('cursor'), PRICE_CURSOR),
+                                      per_page)
     
-    return render_template('search.html', packages=packages, search_params=request.args)
+    return render_template('search.html', packages=page, total=total,
+                           next_url=next_page_url(next_cursor), search_params=request.args)
 
 @app.route('/package/<int:package_id>')
+@cached_page
 def package_detail(package_id):
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM packages WHERE id = ?', (package_id,))
-    package = cursor.fetchone()
-    conn.close()
+    package = repository.get_package(get_db(), package_id)
     
     if not package:
         flash('Pacote não encontrado!', 'error')
@@ -244,36 +2439,41 @@ def package_detail(package_id):
 @app.route('/add_to_cart', methods=['POST'])
 @login_required
 def add_to_cart():
-    package_id = request.form.get('package_id')
-    travelers = request.form.get('travelers', 1)
+    package_id = request.form.get('package_id', type=int)
+    travelers = request.form.get('travelers', 1, type=int)
     check_in = request.form.get('check_in')
     check_out = request.form.get('check_out')
     
+    if package_id is None or not travelers or travelers < 1:
+        flash('Pacote não encontrado!', 'error')
+        return redirect(url_for('home'))
+    
     if not check_in or not check_out:
         flash('Por favor, selecione as datas de check-in e check-out!', 'error')
         return redirect(url_for('package_detail', package_id=package_id))
     
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    
-    # Check if item already in cart
-    cursor.execute('SELECT * FROM cart WHERE user_id = ? AND package_id = ?', 
-                   (current_user.id, package_id))
-    existing = cursor.fetchone()
+    # Early answer from the cached tree; checkout re-checks under the write lock
+    inventory = inventory_index.get(package_id)
+    stay = stay_range(check_in, check_out)
+    if inventory is not None and (stay is None or not inventory.available(*stay, travelers)):
+        flash('Não há disponibilidade para as datas selecionadas!', 'error')
+        return redirect(url_for('package_detail', package_id=package_id))
     
-    if existing:
-        cursor.execute('''
-            UPDATE cart SET travelers = ?, check_in = ?, check_out = ? 
-            WHERE user_id = ? AND package_id = ?
-        ''', (travelers, check_in, check_out, current_user.id, package_id))
-    else:
-        cursor.execute('''
-            INSERT INTO cart (user_id, package_id, travelers, check_in, check_out)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (current_user.id, package_id, travelers, check_in, check_out))
+    conn = get_db()
+    cursor = conn.cursor()
     
+    # Adding a package that is already in the cart replaces its dates and travelers
+    cursor.execute('''
+        INSERT INTO cart (user_id, package_id, travelers, check_in, check_out)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, package_id) DO UPDATE SET
+            travelers = excluded.travelers,
+            check_in = excluded.check_in,
+            check_out = excluded.check_out,
+            created_at = CURRENT_TIMESTAMP
+    ''', (current_user.id, package_id, travelers, check_in, check_out))
     conn.commit()
-    conn.close()
+    invalidate_cart()
     
     flash('Pacote adicionado ao carrinho!', 'success')
     return redirect(url_for('cart'))
@@ -281,29 +2481,16 @@ def add_to_cart():
 @app.route('/cart')
 @login_required
 def cart():
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT c.*, p.title, p.destination, p.price, p.image_url, p.duration
-        FROM cart c
-        JOIN packages p ON c.package_id = p.id
-        WHERE c.user_id = ?
-    ''', (current_user.id,))
-    cart_items = cursor.fetchall()
-    conn.close()
-    
-    total = sum(item[7] * item[3] for item in cart_items)  # price * travelers
-    
-    return render_template('cart.html', cart_items=cart_items, total=total)
+    return render_template('cart.html', summary=get_cart_summary())
 
 @app.route('/remove_from_cart/<int:cart_id>')
 @login_required
 def remove_from_cart(cart_id):
-    conn = sqlite3.connect('travel_booking.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM cart WHERE id = ? AND user_id = ?', (cart_id, current_user.id))
     conn.commit()
-    conn.close()
+    invalidate_cart()
     
     flash('Item removido do carrinho!', 'success')
     return redirect(url_for('cart'))
@@ -311,81 +2498,167 @@ def remove_from_cart(cart_id):
 @app.route('/checkout')
 @login_required
 def checkout():
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT c.*, p.title, p.destination, p.price, p.image_url, p.duration
-        FROM cart c
-        JOIN packages p ON c.package_id = p.id
-        WHERE c.user_id = ?
-    ''', (current_user.id,))
-    cart_items = cursor.fetchall()
-    conn.close()
+    summary = get_cart_summary()
     
-    if not cart_items:
+    if not summary.items:
         flash('Carrinho vazio!', 'error')
         return redirect(url_for('home'))
     
-    total = sum(item[7] * item[3] for item in cart_items)
+    # Lock the prices shown on this page; process_payment charges the quote
+    # stored under the form's idempotency key. A user has one open quote:
+    # reopening the page while the cart and prices are unchanged shows the
+    # same one, so two tabs can't pay for the same cart twice.
+    user_id = current_user.id
+    items = sorted((item.package_id, item.travelers, item.check_in, item.check_out, item.price)
+                   for item in summary.items)
+    quote_age = '-%d seconds' % app.config['CHECKOUT_QUOTE_TTL']
     
-    return render_template('checkout.html', cart_items=cart_items, total=total)
+    def open_quote(cursor):
+        cursor.execute('''
+            SELECT token, package_id, travelers, check_in, check_out, unit_price
+            FROM checkout_quotes
+            WHERE user_id = ? AND created_at >= datetime('now', ?)
+        ''', (user_id, quote_age))
+        quotes = {}
+        for row in cursor.fetchall():
+            quotes.setdefault(row[0], []).append(tuple(row[1:]))
+        for token, quoted in quotes.items():
+            if sorted(quoted) == items:
+                return token
+        token = secrets.token_urlsafe(16)
+        cursor.execute('DELETE FROM checkout_quotes WHERE user_id = ?', (user_id,))
+        cursor.executemany('''
+            INSERT INTO checkout_quotes (token, package_id, user_id, travelers, check_in, check_out,
+                                         unit_price, total_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(token, item.package_id, user_id, item.travelers, item.check_in, item.check_out,
+               item.price, item.subtotal) for item in summary.items])
+        return token
+    
+    token = run_transaction(get_db(), open_quote)
+    
+    return render_template('checkout.html', summary=summary, idempotency_key=token)
 
 @app.route('/process_payment', methods=['POST'])
 @login_required
 def process_payment():
     payment_method = request.form.get('payment_method')
-    installments = request.form.get('installments', 1)
+    installments = request.form.get('installments', 1, type=int) or 1
+    installments = max(1, min(installments, repository.CartSummary.MAX_INSTALLMENTS))
+    # Replays of the same form post (double click, retry after a timeout)
+    # carry the same key and get the original batch back.
+    token = (request.form.get('idempotency_key') or request.headers.get('Idempotency-Key')
+             or secrets.token_urlsafe(16))
+    user_id = current_user.id
+    quote_age = '-%d seconds' % app.config['CHECKOUT_QUOTE_TTL']
+    reserved_packages = []
     
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
+    def place_order(cursor):
+        del reserved_packages[:]
+        cursor.execute('SELECT user_id, bookings FROM checkout_batches WHERE token = ?', (token,))
+        batch = cursor.fetchone()
+        if batch:
+            return batch[1] if batch[0] == user_id else 0
+        
+        # The quote holds the items and prices the checkout page showed. It is
+        # only good while every item is still in the cart as quoted: a cart
+        # changed or paid for since then makes it stale.
+        cursor.execute('''
+            SELECT q.package_id, q.travelers, q.check_in, q.check_out, p.title, c.id
+            FROM checkout_quotes q
+            JOIN packages p ON q.package_id = p.id
+            LEFT JOIN cart c ON c.user_id = q.user_id AND c.package_id = q.package_id
+                AND c.travelers = q.travelers AND c.check_in = q.check_in
+                AND c.check_out = q.check_out
+            WHERE q.token = ? AND q.user_id = ? AND q.created_at >= datetime('now', ?)
+        ''', (token, user_id, quote_age))
+        quoted = cursor.fetchall()
+        if not quoted:
+            return None
+        if any(row[5] is None for row in quoted):
+            raise StaleQuote()
+        
+        # Hold seats for every item first; SoldOut rolls the whole order back
+        for package_id, travelers, check_in, check_out, title, _ in quoted:
+            if not reserve_seats(cursor, package_id, check_in, check_out, travelers):
+                raise SoldOut(title)
+            reserved_packages.append(package_id)
+        
+        # Create bookings for the whole quote in one statement
+        cursor.execute('''
+            INSERT INTO bookings (user_id, package_id, travelers, check_in, check_out,
+                                total_price, payment_method, payment_installments,
+                                status, batch_token, seats_held)
+            SELECT q.user_id, q.package_id, q.travelers, q.check_in, q.check_out,
+                   q.total_price, ?, ?, 'confirmed', q.token,
+                   EXISTS (SELECT 1 FROM package_inventory i WHERE i.package_id = q.package_id)
+            FROM checkout_quotes q
+            JOIN packages p ON q.package_id = p.id
+            WHERE q.token = ? AND q.user_id = ?
+        ''', (payment_method, installments, token, user_id))
+        count = cursor.rowcount
+        
+        apply_booking_stats(cursor, 'b.batch_token = ?', (token,))
+        cursor.execute('''
+            INSERT INTO checkout_batches (token, user_id, bookings, total_price)
+            SELECT ?, ?, COUNT(*), SUM(total_price) FROM bookings WHERE batch_token = ?
+        ''', (token, user_id, token))
+        job_queue.enqueue(cursor, 'booking_confirmation', {'batch': token})
+        
+        # Clear the paid items; anything added after checkout stays in the cart
+        cursor.execute('''
+            DELETE FROM cart WHERE user_id = ? AND package_id IN (
+                SELECT package_id FROM checkout_quotes WHERE token = ?
+            )
+        ''', (user_id, token))
+        # Quotes opened in other tabs are for the cart just paid
+        cursor.execute('DELETE FROM checkout_quotes WHERE user_id = ?', (user_id,))
+        return count
     
-    # Get cart items
-    cursor.execute('''
-        SELECT c.*, p.price
-        FROM cart c
-        JOIN packages p ON c.package_id = p.id
-        WHERE c.user_id = ?
-    ''', (current_user.id,))
-    cart_items = cursor.fetchall()
-    
-    if not cart_items:
+    try:
+        placed = run_transaction(get_db(), place_order)
+    except SoldOut as e:
+        flash('Não há mais disponibilidade para %s nas datas escolhidas.' % e, 'error')
+        return redirect(url_for('cart'))
+    except StaleQuote:
+        flash('Seu carrinho mudou desde o início do pagamento. Revise e finalize novamente.', 'error')
+        return redirect(url_for('cart'))
+    for package_id in reserved_packages:
+        inventory_index.invalidate(package_id)
+    invalidate_cart()
+    if placed is None:
+        flash('Sua sessão de pagamento expirou. Revise o carrinho e finalize novamente.', 'error')
+        return redirect(url_for('cart'))
+    if not placed:
         flash('Carrinho vazio!', 'error')
         return redirect(url_for('home'))
     
-    # Create bookings
-    for item in cart_items:
-        total_price = item[7] * item[3]  # price * travelers
-        cursor.execute('''
-            INSERT INTO bookings (user_id, package_id, travelers, check_in, check_out, 
-                                total_price, payment_method, payment_installments, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'confirmed')
-        ''', (current_user.id, item[2], item[3], item[4], item[5], 
-              total_price, payment_method, installments))
-    
-    # Clear cart
-    cursor.execute('DELETE FROM cart WHERE user_id = ?', (current_user.id,))
-    
-    conn.commit()
-    conn.close()
-    
     flash('Pagamento processado com sucesso! Suas reservas foram confirmadas.', 'success')
     return redirect(url_for('profile'))
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        email = request.form.get('email')
-        password = request.form.get('password')
+        email = request.form.get('email') or ''
+        password = request.form.get('password') or ''
         
-        conn = sqlite3.connect('travel_booking.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        user_data = cursor.fetchone()
-        conn.close()
+        refused = throttle_login('login.html', email)
+        if refused:
+            return refused
+        
+        user, password_hash = repository.user_credentials(get_db(), email)
+        
+        try:
+            with timed('password'):
+                valid = user is not None and hasher.verify(password_hash, password)
+        except passwords.HasherBusy:
+            return hasher_busy('login.html')
         
-        if user_data and check_password_hash(user_data[2], password):
-            user = User(user_data[0], user_data[1], user_data[3], user_data[5])
+        if valid:
+            rehash_later(user.id, password_hash, password)
             login_user(user)
+            remember_user(user)
+            invalidate_cart()
             flash('Login realizado com sucesso!', 'success')
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('home'))
@@ -399,34 +2672,40 @@ def register():
     if request.method == 'POST':
         name = request.form.get('name')
         email = request.form.get('email')
-        password = request.form.get('password')
+        password = request.form.get('password') or ''
         phone = request.form.get('phone')
         
-        conn = sqlite3.connect('travel_booking.db')
+        refused = throttle_login('register.html')
+        if refused:
+            return refused
+        
+        conn = get_db()
         cursor = conn.cursor()
         
         # Check if user exists
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        if cursor.fetchone():
+        if repository.email_taken(conn, email):
             flash('Email já cadastrado!', 'error')
         else:
-            password_hash = generate_password_hash(password)
+            try:
+                with timed('password'):
+                    password_hash = hasher.hash(password)
+            except passwords.HasherBusy:
+                return hasher_busy('register.html')
             cursor.execute('''
                 INSERT INTO users (name, email, password_hash, phone)
                 VALUES (?, ?, ?, ?)
             ''', (name, email, password_hash, phone))
+            bump_counter(cursor, 'customers')
             conn.commit()
             flash('Cadastro realizado com sucesso!', 'success')
-            conn.close()
             return redirect(url_for('login'))
-        
-        conn.close()
     
     return render_template('register.html')
 
 @app.route('/logout')
 @login_required
 def logout():
+    forget_user(current_user.id)
     logout_user()
     flash('Logout realizado com sucesso!', 'success')
     return redirect(url_for('home'))
@@ -434,37 +2713,51 @@ def logout():
 @app.route('/profile')
 @login_required
 def profile():
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT b.*, p.title, p.destination, p.image_url
-        FROM bookings b
-        JOIN packages p ON b.package_id = p.id
-        WHERE b.user_id = ?
-        ORDER BY b.created_at DESC
-    ''', (current_user.id,))
-    bookings = cursor.fetchall()
-    conn.close()
+    status = request.args.get('status')
+    when = request.args.get('when')
+    per_page = page_size(20, maximum=50)
+    conn = get_db()
+    summary = repository.booking_summary(conn, current_user.id)
+    rows = repository.booking_history(conn, current_user.id, status, when,
+                                      decode_cursor(request.args.get('cursor'), LISTING_CURSOR),
+                                      per_page + 1)
     
-    return render_template('profile.html', bookings=bookings)
+    # The body is streamed after the session is saved, so flashes are taken
+    # out of it now; the template gets the same messages
+    get_flashed_messages(with_categories=True)
+    return app.response_class(buffered(stream_template(
+        'profile.html', bookings=StreamedPage(rows, per_page, lambda b: (b.created_at, b.id)),
+        summary=summary, status=status, when=when)))
 
 @app.route('/cancel_booking/<int:booking_id>')
 @login_required
 def cancel_booking(booking_id):
-    conn = sqlite3.connect('travel_booking.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         UPDATE bookings SET status = 'cancelled' 
         WHERE id = ? AND user_id = ? AND status = 'confirmed'
+        RETURNING package_id, check_in, check_out, travelers, seats_held
     ''', (booking_id, current_user.id))
+    booking = cursor.fetchone()
     
-    if cursor.rowcount > 0:
+    if booking:
+        apply_booking_stats(cursor, 'b.id = ?', (booking_id,), sign=-1)
+        try:
+            if booking[4]:
+                release_seats(cursor, *booking[:4])
+        except SeatAccountingError:
+            conn.rollback()
+            app.logger.exception('Seats of booking %d not released', booking_id)
+            flash('Não foi possível cancelar a reserva agora. Tente novamente mais tarde.', 'error')
+            return redirect(url_for('profile'))
+        job_queue.enqueue(cursor, 'booking_cancellation', {'booking_id': booking_id})
+        inventory_index.invalidate(booking[0])
         flash('Reserva cancelada com sucesso!', 'success')
     else:
         flash('Não foi possível cancelar a reserva!', 'error')
     
     conn.commit()
-    conn.close()
     
     return redirect(url_for('profile'))
 
@@ -475,26 +2768,50 @@ def admin():
         flash('Acesso negado!', 'error')
         return redirect(url_for('home'))
     
-    conn = sqlite3.connect('travel_booking.db')
+    snapshot = catalog.get()
+    packages, next_cursor = seek_page(snapshot.ordered, listing_key,
+                                      decode_cursor(request.args.get('cursor'), LISTING_CURSOR),
+                                      page_size(50), descending=True)
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT * FROM packages ORDER BY created_at DESC')
-    packages = cursor.fetchall()
+    cursor.execute("SELECT bookings, revenue FROM booking_stats WHERE scope = 'total' AND key = ''")
+    total_bookings, total_revenue = cursor.fetchone() or (0, 0)
     
-    cursor.execute('SELECT COUNT(*) FROM bookings WHERE status = "confirmed"')
-    total_bookings = cursor.fetchone()[0]
+    cursor.execute("SELECT value FROM stats_counters WHERE name = 'customers'")
+    row = cursor.fetchone()
+    total_users = row[0] if row else 0
     
-    cursor.execute('SELECT COUNT(*) FROM users WHERE is_admin = 0')
-    total_users = cursor.fetchone()[0]
+    cursor.execute('''
+        SELECT key, bookings, revenue FROM booking_stats
+        WHERE scope = 'category' AND bookings > 0
+        ORDER BY revenue DESC
+    ''')
+    category_stats = cursor.fetchall()
     
-    cursor.execute('SELECT SUM(total_price) FROM bookings WHERE status = "confirmed"')
-    total_revenue = cursor.fetchone()[0] or 0
+    cursor.execute('''
+        SELECT key, bookings, revenue FROM booking_stats
+        WHERE scope = 'day' AND key >= date('now', '-13 days')
+        ORDER BY key DESC
+    ''')
+    daily_stats = cursor.fetchall()
     
-    conn.close()
+    cursor.execute('''
+        SELECT key, bookings, revenue FROM booking_stats
+        WHERE scope = 'package' AND bookings > 0
+        ORDER BY revenue DESC LIMIT 5
+    ''')
+    top_packages = [(snapshot.by_id[int(key)].title if int(key) in snapshot.by_id else '#' + key,
+                     bookings, revenue)
+                    for key, bookings, revenue in cursor.fetchall()]
     
     return render_template('admin.html', packages=packages, 
+                         total_packages=len(snapshot.ordered),
+                         next_url=next_page_url(next_cursor),
                          total_bookings=total_bookings, total_users=total_users, 
-                         total_revenue=total_revenue)
+                         total_revenue=total_revenue, category_stats=category_stats,
+                         daily_stats=daily_stats, top_packages=top_packages)
 
 @app.route('/admin/add_package', methods=['GET', 'POST'])
 @login_required
@@ -516,7 +2833,7 @@ def add_package():
         transport = request.form.get('transport')
         featured = bool(request.form.get('featured'))
         
-        conn = sqlite3.connect('travel_booking.db')
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO packages (title, destination, description, price, duration, 
@@ -525,7 +2842,8 @@ def add_package():
         ''', (title, destination, description, price, duration, category, 
               image_url, includes, hotel, transport, featured))
         conn.commit()
-        conn.close()
+        catalog.invalidate()
+        warm_image(image_url)
         
         flash('Pacote adicionado com sucesso!', 'success')
         return redirect(url_for('admin'))
@@ -539,10 +2857,9 @@ def edit_package(package_id):
         flash('Acesso negado!', 'error')
         return redirect(url_for('home'))
     
-    conn = sqlite3.connect('travel_booking.db')
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM packages WHERE id = ?', (package_id,))
-    package = cursor.fetchone()
+    package = repository.get_package(conn, package_id)
     
     if not package:
         flash('Pacote não encontrado!', 'error')
@@ -561,20 +2878,22 @@ def edit_package(package_id):
         transport = request.form.get('transport')
         featured = bool(request.form.get('featured'))
         
-        cursor.execute('''
-            UPDATE packages SET title=?, destination=?, description=?, price=?, 
-                              duration=?, category=?, image_url=?, includes=?, 
-                              hotel=?, transport=?, featured=?
-            WHERE id=?
-        ''', (title, destination, description, price, duration, category, 
-              image_url, includes, hotel, transport, featured, package_id))
+        def update():
+            cursor.execute('''
+                UPDATE packages SET title=?, destination=?, description=?, price=?, 
+                                  duration=?, category=?, image_url=?, includes=?, 
+                                  hotel=?, transport=?, featured=?
+                WHERE id=?
+            ''', (title, destination, description, price, duration, category, 
+                  image_url, includes, hotel, transport, featured, package_id))
+        restate_package_stats(cursor, [package_id], update)
         conn.commit()
-        conn.close()
+        catalog.invalidate()
+        warm_image(image_url)
         
         flash('Pacote atualizado com sucesso!', 'success')
         return redirect(url_for('admin'))
     
-    conn.close()
     return render_template('edit_package.html', package=package)
 
 @app.route('/admin/delete_package/<int:package_id>')
@@ -584,24 +2903,183 @@ def delete_package(package_id):
         flash('Acesso negado!', 'error')
         return redirect(url_for('home'))
     
-    conn = sqlite3.connect('travel_booking.db')
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM packages WHERE id = ?', (package_id,))
+    restate_package_stats(cursor, [package_id],
+                          lambda: cursor.execute('DELETE FROM packages WHERE id = ?', (package_id,)))
     conn.commit()
-    conn.close()
+    catalog.invalidate()
     
     flash('Pacote removido com sucesso!', 'success')
     return redirect(url_for('admin'))
 
+@app.route('/admin/import_packages', methods=['GET', 'POST'])
+@login_required
+def import_packages():
+    if not current_user.is_admin:
+        flash('Acesso negado!', 'error')
+        return redirect(url_for('home'))
+    
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Selecione um arquivo CSV ou JSON Lines.', 'error')
+        else:
+            report = import_package_rows(get_db(), upload.stream, file_format(upload.filename))
+            if report['failed']:
+                flash('%d pacotes importados, %d linhas com erro.'
+                      % (report['imported'], report['failed']), 'error')
+            else:
+                flash('%d pacotes importados com sucesso!' % report['imported'], 'success')
+    
+    return render_template('import_packages.html', report=report)
+
+@app.route('/admin/export/<any(packages, bookings):table>.<any(csv, jsonl):fmt>')
+@login_required
+def export_table(table, fmt):
+    if not current_user.is_admin:
+        flash('Acesso negado!', 'error')
+        return redirect(url_for('home'))
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return app.response_class(stream_with_context(export_lines(get_db(), table, fmt)),
+                              mimetype=mimetype, headers={
+                                  'Content-Disposition': 'attachment; filename=%s.%s' % (table, fmt)})
+
+PACKAGE_JSON_COLUMNS = ('id', 'title', 'destination', 'price', 'duration', 'category',
+                        'image_url', 'featured', 'created_at')
+
+def stream_package_rows(cursor, per_page, key_columns):
+    # Rows are written out as they come off the cursor; the query asks for one
+    # extra row just to know whether there is a next page.
+    def generate():
+        yield '{"packages":['
+        last = None
+        for count, row in enumerate(cursor):
+            if count == per_page:
+                break
+            item = dict(zip(PACKAGE_JSON_COLUMNS, row))
+            yield (',' if count else '') + json.dumps(item, separators=(',', ':'))
+            last = item
+        else:
+            last = None
+        next_cursor = encode_cursor(*(last[c] for c in key_columns)) if last else None
+        yield '],"next":%s}' % json.dumps(next_cursor)
+    return app.response_class(stream_with_context(generate()), mimetype='application/json')
+
+def package_list_query(after, limit):
+    query = 'SELECT %s FROM packages' % ', '.join(PACKAGE_JSON_COLUMNS)
+    params = []
+    if after:
+        query += ' WHERE (created_at, id) < (?, ?)'
+        params.extend(after)
+    query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limit)
+    return query, params
+
+def package_search_query(args, after, limit):
+    query = 'SELECT %s FROM packages WHERE 1=1' % ', '.join(PACKAGE_JSON_COLUMNS)
+    params = []
+    
+    match = fts_query(args.get('q', ''))
+    if match:
+        query += ' AND id IN (SELECT rowid FROM packages_fts WHERE packages_fts MATCH ?)'
+        params.append(match)
+    
+    if args.get('category'):
+        query += ' AND category = ?'
+        params.append(args['category'])
+    
+    min_price = _parse_price(args.get('min_price'))
+    if min_price is not None:
+        query += ' AND price >= ?'
+        params.append(min_price)
+    
+    max_price = _parse_price(args.get('max_price'))
+    if max_price is not None:
+        query += ' AND price <= ?'
+        params.append(max_price)
+    
+    if after:
+        query += ' AND (price, id) > (?, ?)'
+        params.extend(after)
+    
+    query += ' ORDER BY price, id LIMIT ?'
+    params.append(limit)
+    return query, params
+
+@app.route('/api/packages')
+def api_packages():
+    per_page = page_size(50)
+    query, params = package_list_query(decode_cursor(request.args.get('cursor'), LISTING_CURSOR),
+                                       per_page + 1)
+    return stream_package_rows(get_db().execute(query, params), per_page, ('created_at', 'id'))
+
+@app.route('/api/packages/search')
+def api_search():
+    per_page = page_size(50)
+    query, params = package_search_query(request.args,
+                                         decode_cursor(request.args.get('cursor'), PRICE_CURSOR),
+                                         per_page + 1)
+    return stream_package_rows(get_db().execute(query, params), per_page, ('price', 'id'))
+
+@app.route('/api/packages/<int:package_id>/availability')
+def package_availability(package_id):
+    # Seats left per day for the booking calendar; unmanaged packages are unlimited
+    inventory = inventory_index.get(package_id)
+    if inventory is None:
+        return jsonify({'managed': False, 'days': {}})
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        start = datetime.now().date()
+    days = min(request.args.get('days', 60, type=int) or 60, 366)
+    calendar = {}
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        calendar[day.isoformat()] = inventory.remaining(day)
+    return jsonify({'managed': True, 'days': calendar})
+
 @app.route('/api/cart_count')
 @login_required
 def cart_count():
-    conn = sqlite3.connect('travel_booking.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM cart WHERE user_id = ?', (current_user.id,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return jsonify({'count': count})
+    # The page embeds the count already; this stays for scripts that need to
+    # refresh it and answers 304 while the count is unchanged.
+    count = get_cart_count()
+    response = jsonify({'count': count})
+    response.set_etag('cart-%s-%d' % (current_user.id, count))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+@app.route('/admin/pool_stats')
+@login_required
+def pool_stats():
+    if not current_user.is_admin:
+        return jsonify({'error': 'forbidden'}), 403
+    stats = db_pool.stats()
+    stats['replicas'] = {pool.path: dict(pool.stats(), age=time.time() - (pool.snapshot_time() or 0))
+                         for pool in replicas.pools}
+    return jsonify(stats)
+
+@app.route('/admin/cache_stats')
+@login_required
+def cache_stats():
+    if not current_user.is_admin:
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify({'users': user_cache.stats(), 'catalog': {'loads': catalog.loads},
+                    'pages': page_cache.stats(), 'cart_summaries': cart_summaries.stats(),
+                    'cart_sweeper': cart_sweeper.stats(), 'password_hasher': hasher.stats(),
+                    'images': image_cache.stats(),
+                    'login_limits': {'ip': ip_limiter.stats(), 'email': email_limiter.stats()}})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Scrapers can't log in; see metrics_allowed
+    if not metrics_allowed(request.remote_addr, request.headers.get('Authorization'),
+                           request.headers.get('X-Forwarded-For')):
+        return jsonify({'error': 'forbidden'}), 403
+    return app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     init_db()
@@ -0,0 +1,4 @@
+// Entry of the Vite build: the site stylesheet plus the shared page
+// behaviour, bundled into static/dist.
+import './main.css';
+import '../static/js/site.js';
@@ -0,0 +1,632 @@
+# Load test for the booking flow. Seeds a synthetic catalog, customer base and
+# booking history, drives home, search, package_detail, add_to_cart,
+# checkout, process_payment and admin through the Flask test client and
+# through gunicorn workers, and writes latency percentiles, throughput and
+# peak RSS to a JSON file so runs can be compared between commits.
+#
+#   python benchmarks/bench_booking_flow.py seed --database travel_booking.db \
+#       --packages 50000 --users 500000 --bookings 5000000
+#   python benchmarks/bench_booking_flow.py run --database travel_booking.db \
+#       [--mode client|server|both] [--workers 4] [--connections 16]
+#   python benchmarks/bench_booking_flow.py compare OLD.json NEW.json
+#
+# `run` without --database seeds a small dataset in a temp directory first.
+# `run --replicas N` routes reads to N replica files that a
+# `flask refresh-replicas` child process rewrites every --replica-interval
+# seconds.
+# Results go to benchmarks/results/<commit>-<time>.json unless --output is
+# given. Throughput is requests per second of stage wall time; add_to_cart,
+# checkout and process_payment run as one purchase stage, so their rates are
+# purchases per second. Everything stays on 127.0.0.1.
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+PASSWORD = 'bench-password'
+ADMIN = ('admin@cvc.com', 'admin123')
+CITIES = ['Cancún', 'Rio de Janeiro', 'Paris', 'Orlando', 'Maldivas', 'Búzios',
+          'Cusco', 'Nova York', 'Gramado', 'Lisboa', 'Roma', 'Bariloche']
+CATEGORIES = ['praia', 'cidade', 'aventura', 'família', 'romântico', 'lua-de-mel']
+WORDS = ['praia', 'resort', 'trilha', 'cachoeira', 'museu', 'gastronomia', 'mergulho',
+         'passeio', 'spa', 'neve', 'vinho', 'história', 'família', 'romântico']
+SEARCH_TERMS = ['cancun', 'Paris', 'rio', 'gastronomia', 'buzios spa', 'neve']
+KEY_RE = re.compile(rb'name="idempotency_key" value="([^"]+)"')
+CHUNK = 50000
+
+# (stage, who is signed in, steps run in order on every iteration)
+STAGES = [
+    ('home', 'anonymous', ('home',)),
+    ('search', 'anonymous', ('search',)),
+    ('package_detail', 'anonymous', ('package_detail',)),
+    ('purchase', 'customer', ('add_to_cart', 'checkout', 'process_payment')),
+    ('admin', 'admin', ('admin',)),
+]
+
+travel = None
+
+
+def configure(database):
+    # Shared by the test client and the gunicorn workers. Every visitor signs
+    # in from 127.0.0.1, so the login rate limits are off.
+    os.environ['DATABASE_PATH'] = database
+    os.environ.setdefault('SECRET_KEY', 'bench-secret')
+    os.environ.setdefault('LOGIN_IP_LIMIT', '0')
+    os.environ.setdefault('LOGIN_EMAIL_LIMIT', '0')
+
+
+def load_app(database):
+    # app.py reads its configuration at import time
+    global travel
+    configure(database)
+    import app
+    travel = app
+    return app
+
+
+def customer_email(n):
+    return 'user%d@bench.example' % n
+
+
+# Dataset
+def chunked(rows, size=CHUNK):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_rows(conn, sql, rows):
+    for batch in chunked(rows):
+        conn.executemany(sql, batch)
+        conn.commit()
+
+
+def seed(database, packages, users, bookings, seed=42):
+    os.environ['METRICS_SQL'] = '0'
+    load_app(database)
+    travel.init_db()
+    rng = random.Random(seed)
+    conn = travel.db_pool.connect()
+    if conn.execute('SELECT COUNT(*) FROM users WHERE is_admin = 0').fetchone()[0]:
+        raise SystemExit('%s already has customers; seed a fresh file' % database)
+    conn.execute('PRAGMA synchronous = OFF')
+    started = time.perf_counter()
+    today = date.today()
+
+    def package_rows():
+        for i in range(packages):
+            city = rng.choice(CITIES)
+            created = today - timedelta(days=rng.randrange(1000), seconds=rng.randrange(86400))
+            yield ('Pacote %s %d' % (city, i), city,
+                   ' '.join(rng.choice(WORDS) for _ in range(30)), round(rng.uniform(500, 9000), 2),
+                   rng.randint(3, 14), rng.choice(CATEGORIES), 'https://example.com/%d.jpg' % i,
+                   ', '.join(rng.sample(WORDS, 4)), 'Hotel %d' % i, 'Aéreo',
+                   int(rng.random() < 0.01), created.strftime('%Y-%m-%d %H:%M:%S'))
+
+    insert_rows(conn, '''
+        INSERT INTO packages (title, destination, description, price, duration, category,
+                              image_url, includes, hotel, transport, featured, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', package_rows())
+    catalog = conn.execute('SELECT id, price, duration FROM packages').fetchall()
+
+    # One shared hash: hashing 500k distinct passwords would take hours
+    password_hash = travel.generate_password_hash(PASSWORD)
+    insert_rows(conn, '''
+        INSERT INTO users (email, password_hash, name, phone) VALUES (?, ?, ?, ?)
+    ''', ((customer_email(n), password_hash, 'Cliente %d' % n, '11 9%08d' % n)
+          for n in range(1, users + 1)))
+    first, last = conn.execute(
+        'SELECT MIN(id), MAX(id) FROM users WHERE is_admin = 0').fetchone()
+
+    def booking_rows():
+        for _ in range(bookings):
+            package_id, price, duration = rng.choice(catalog)
+            travelers = rng.randint(1, 4)
+            check_in = today + timedelta(days=rng.randrange(-365, 365))
+            created = check_in - timedelta(days=rng.randrange(1, 180))
+            yield (rng.randint(first, last), package_id, travelers, check_in.isoformat(),
+                   (check_in + timedelta(days=duration)).isoformat(),
+                   round(price * travelers, 2),
+                   'cancelled' if rng.random() < 0.1 else 'confirmed',
+                   rng.choice(('credit_card', 'pix')), rng.randint(1, 12),
+                   created.isoformat() + ' 12:00:00')
+
+    if users:
+        insert_rows(conn, '''
+            INSERT INTO bookings (user_id, package_id, travelers, check_in, check_out,
+                                  total_price, status, payment_method, payment_installments,
+                                  created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', booking_rows())
+    travel.rebuild_stats(conn)
+    # No ANALYZE: the app never runs it, and stats gathered while every
+    # seeded batch_token is NULL steer checkout away from its index
+    conn.commit()
+    conn.close()
+    print('seeded %s in %.1fs: %s' % (database, time.perf_counter() - started,
+                                      dataset_counts(database)))
+
+
+def dataset_counts(database):
+    conn = sqlite3.connect(database)
+    counts = {table: conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+              for table in ('packages', 'users', 'bookings')}
+    conn.close()
+    return counts
+
+
+def package_ids(database):
+    conn = sqlite3.connect(database)
+    ids = [row[0] for row in conn.execute('SELECT id FROM packages')]
+    conn.close()
+    return ids
+
+
+# Sessions: the same visitor code runs in-process and over HTTP
+class ClientSession:
+    def __init__(self):
+        self.client = travel.app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.headers.get('Location', ''), response.get_data()
+
+
+class HttpSession:
+    # One connection with its own cookie jar
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body, headers)
+                response = self.conn.getresponse()
+                payload = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server dropped an idle connection; try once on a new one
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or ():
+            name, _, rest = header.partition('=')
+            value = rest.split(';', 1)[0]
+            if value and 'expires=thu, 01 jan 1970' not in header.lower():
+                self.cookies[name] = value
+            else:
+                self.cookies.pop(name, None)
+        if response.will_close:
+            self.conn.close()
+            self.conn = None
+        return response.status, response.getheader('Location', ''), payload
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class Visitor:
+    # Each step returns True when the response is the one a browser expects
+    def __init__(self, session, rng, packages):
+        self.session = session
+        self.rng = rng
+        self.packages = packages
+        self.key = None
+
+    def login(self, email, password):
+        status, location, _ = self.session.request('POST', '/login',
+                                                   {'email': email, 'password': password})
+        if status != 302:
+            raise SystemExit('login failed for %s' % email)
+
+    def home(self):
+        return self.session.request('GET', '/')[0] == 200
+
+    def search(self):
+        query = urlencode({'destination': self.rng.choice(SEARCH_TERMS)})
+        return self.session.request('GET', '/search?' + query)[0] == 200
+
+    def package_detail(self):
+        path = '/package/%d' % self.rng.choice(self.packages)
+        return self.session.request('GET', path)[0] == 200
+
+    def add_to_cart(self):
+        check_in = date.today() + timedelta(days=self.rng.randrange(30, 365))
+        status, location, _ = self.session.request('POST', '/add_to_cart', {
+            'package_id': self.rng.choice(self.packages),
+            'travelers': self.rng.randint(1, 4),
+            'check_in': check_in.isoformat(),
+            'check_out': (check_in + timedelta(days=7)).isoformat(),
+        })
+        return status == 302 and urlsplit(location).path == '/cart'
+
+    def checkout(self):
+        status, _, body = self.session.request('GET', '/checkout')
+        match = KEY_RE.search(body) if status == 200 else None
+        self.key = match.group(1).decode('ascii') if match else None
+        return self.key is not None
+
+    def process_payment(self):
+        if self.key is None:
+            return False
+        status, location, _ = self.session.request('POST', '/process_payment', {
+            'payment_method': 'credit_card', 'installments': 3, 'idempotency_key': self.key,
+        })
+        self.key = None
+        return status == 302 and urlsplit(location).path == '/profile'
+
+    def admin(self):
+        return self.session.request('GET', '/admin')[0] == 200
+
+
+def sign_in(visitor, role, n):
+    if role == 'customer':
+        visitor.login(customer_email(n), PASSWORD)
+    elif role == 'admin':
+        visitor.login(*ADMIN)
+
+
+# Measurement
+class Timings:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            self.errors[name] = self.errors.get(name, 0) + (not ok)
+
+    def summary(self, elapsed):
+        results = {}
+        for name, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            count = len(latencies)
+            results[name] = {
+                'requests': count,
+                'errors': self.errors[name],
+                'p50_ms': percentile(latencies, 0.50) * 1e3,
+                'p95_ms': percentile(latencies, 0.95) * 1e3,
+                'p99_ms': percentile(latencies, 0.99) * 1e3,
+                'max_ms': latencies[-1] * 1e3,
+                'mean_ms': sum(latencies) / count * 1e3,
+                'throughput': count / elapsed,
+            }
+        return results
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def drive(visitor, steps, timings, iterations=None, deadline=None):
+    done = 0
+    while ((iterations is None or done < iterations)
+           and (deadline is None or time.perf_counter() < deadline)):
+        for name in steps:
+            started = time.perf_counter()
+            try:
+                ok = getattr(visitor, name)()
+            except (OSError, http.client.HTTPException):
+                ok = False
+            if timings is not None:
+                timings.record(name, time.perf_counter() - started, ok)
+        done += 1
+
+
+def run_client(packages, requests, warmup, seed):
+    scenarios = {}
+    for stage, role, steps in STAGES:
+        visitor = Visitor(ClientSession(), random.Random(seed), packages)
+        sign_in(visitor, role, 1)
+        drive(visitor, steps, None, iterations=warmup)
+        timings = Timings()
+        started = time.perf_counter()
+        drive(visitor, steps, timings, iterations=requests)
+        scenarios.update(timings.summary(time.perf_counter() - started))
+        print_stage(stage, scenarios, steps)
+    # ru_maxrss is in kilobytes on Linux
+    return {'requests_per_scenario': requests,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'scenarios': scenarios}
+
+
+def process_tree(pid):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        parent = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(parent, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, ()))
+    return tree
+
+
+def high_water_mb(pid):
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit('server on port %d did not start' % port)
+
+
+def run_server(packages, workers, connections, seconds, warmup, seed, port):
+    command = ['gunicorn', '-w', str(workers), '-b', '127.0.0.1:%d' % port,
+               '--log-level', 'warning', 'app:app']
+    server = subprocess.Popen(command, cwd=ROOT, env=os.environ.copy())
+    scenarios = {}
+    try:
+        wait_for(port)
+        for stage, role, steps in STAGES:
+            visitors = []
+            for n in range(connections):
+                visitor = Visitor(HttpSession(port), random.Random(seed + n), packages)
+                sign_in(visitor, role, n + 1)
+                visitors.append(visitor)
+            timings = Timings()
+            for phase in ('warmup', 'measure'):
+                deadline = time.perf_counter() + seconds if phase == 'measure' else None
+                threads = [threading.Thread(target=drive, args=(
+                    visitor, steps, timings if phase == 'measure' else None,
+                    warmup if phase == 'warmup' else None, deadline)) for visitor in visitors]
+                started = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            scenarios.update(timings.summary(time.perf_counter() - started))
+            for visitor in visitors:
+                visitor.session.close()
+            print_stage(stage, scenarios, steps)
+        # VmHWM is each process's own peak; read it before the workers exit
+        peaks = [high_water_mb(pid) for pid in process_tree(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+    return {'workers': workers, 'connections': connections, 'seconds': seconds,
+            'peak_rss_mb': sum(peaks), 'worker_peak_rss_mb': max(peaks[1:] or peaks),
+            'scenarios': scenarios}
+
+
+def print_stage(stage, scenarios, steps):
+    for name in steps:
+        result = scenarios[name]
+        print('  %-16s %7d req %5d err  p50 %8.2f  p95 %8.2f  p99 %8.2f ms  %8.1f/s' % (
+            name, result['requests'], result['errors'], result['p50_ms'], result['p95_ms'],
+            result['p99_ms'], result['throughput']))
+
+
+def start_replicas(database, count, interval):
+    # Replica files live in their own temp directory; the first copy is made
+    # before any request so reads can use them from the start
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_REPLICAS'] = ','.join(
+        os.path.join(directory, 'replica%d.db' % n) for n in range(count))
+    command = [sys.executable, '-m', 'flask', '--app', 'app', 'refresh-replicas']
+    env = dict(os.environ, DATABASE_PATH=database, PASSWORD_WORKERS='0')
+    subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+    refresher = subprocess.Popen(command + ['--interval', str(interval)], cwd=ROOT, env=env,
+                                 stdout=subprocess.DEVNULL)
+    return directory, refresher
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git'] + list(args), cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    tmpdir = None
+    database = args.database
+    if database is None:
+        tmpdir = tempfile.mkdtemp()
+        database = os.path.join(tmpdir, 'bench.db')
+        # Seed in a child process so its memory does not count as our peak RSS
+        subprocess.run([sys.executable, os.path.abspath(__file__), 'seed', '--database', database,
+                        '--packages', str(args.packages), '--users', str(args.users),
+                        '--bookings', str(args.bookings), '--seed', str(args.seed)], check=True)
+    elif not os.path.exists(database):
+        raise SystemExit('%s does not exist; create it with the seed command' % database)
+    database = os.path.abspath(database)
+    counts = dataset_counts(database)
+    if counts['users'] <= max(args.connections, 1):
+        raise SystemExit('need more than %d customers in %s' % (args.connections, database))
+    packages = package_ids(database)
+
+    commit = git('rev-parse', 'HEAD')
+    results = {
+        'commit': commit,
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'cpus': os.cpu_count(),
+        'dataset': counts,
+        'replicas': args.replicas,
+        'runs': {},
+    }
+    print('dataset %s' % counts)
+    replica_dir = refresher = None
+    try:
+        if args.replicas:
+            print('%d replicas, refreshed every %gs' % (args.replicas, args.replica_interval))
+            replica_dir, refresher = start_replicas(database, args.replicas,
+                                                    args.replica_interval)
+        if args.mode in ('client', 'both'):
+            print('flask test client, %d requests per scenario' % args.requests)
+            load_app(database)
+            results['runs']['client'] = run_client(packages, args.requests, args.warmup,
+                                                   args.seed)
+        if args.mode in ('server', 'both'):
+            print('gunicorn, %d workers, %d connections, %.0fs per stage'
+                  % (args.workers, args.connections, args.seconds))
+            configure(database)
+            results['runs']['server'] = run_server(packages, args.workers, args.connections,
+                                                   args.seconds, args.warmup, args.seed, args.port)
+    finally:
+        if refresher:
+            refresher.terminate()
+            refresher.wait()
+        if replica_dir:
+            shutil.rmtree(replica_dir, ignore_errors=True)
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, '%s-%s.json' % (
+            (commit or 'unknown')[:12], datetime.now().strftime('%Y%m%d-%H%M%S')))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print('results written to %s' % output)
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print('%s -> %s' % ((old['commit'] or '?')[:12], (new['commit'] or '?')[:12]))
+    if old['dataset'] != new['dataset']:
+        print('warning: datasets differ: %s vs %s' % (old['dataset'], new['dataset']))
+    metrics = (('p50_ms', True), ('p95_ms', True), ('p99_ms', True), ('throughput', False))
+    regressions = 0
+
+    def cell(before, after, lower_is_better):
+        nonlocal regressions
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change > threshold if lower_is_better else change < -threshold
+        regressions += worse
+        return '%9.2f %+7.1f%%%s' % (after, change, '!' if worse else ' ')
+
+    for mode, run_after in new['runs'].items():
+        run_before = old['runs'].get(mode)
+        if run_before is None:
+            continue
+        print('\n%s (peak RSS %s MB)' % (mode, cell(run_before['peak_rss_mb'],
+                                                    run_after['peak_rss_mb'], True).strip()))
+        print('%-16s' % 'scenario' + ''.join('%19s' % name for name, _ in metrics))
+        for name, after in run_after['scenarios'].items():
+            before = run_before['scenarios'].get(name)
+            if before is not None:
+                print('%-16s' % name + ''.join(cell(before[key], after[key], lower)
+                                               for key, lower in metrics))
+    if regressions:
+        print('\n%d metrics regressed by more than %g%% (marked !)' % (regressions, threshold))
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Booking flow load test.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='Fill a database with synthetic data.')
+    run_parser = commands.add_parser('run', help='Run the load test and write a results file.')
+    for sub in (seed_parser, run_parser):
+        sub.add_argument('--packages', type=int, default=2000)
+        sub.add_argument('--users', type=int, default=10000)
+        sub.add_argument('--bookings', type=int, default=100000)
+        sub.add_argument('--seed', type=int, default=42, help='Random seed.')
+    seed_parser.add_argument('--database', default='travel_booking.db')
+
+    run_parser.add_argument('--database', help='Seeded database (default: a fresh temp one).')
+    run_parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+    run_parser.add_argument('--requests', type=int, default=300,
+                            help='Iterations per stage with the test client.')
+    run_parser.add_argument('--warmup', type=int, default=5,
+                            help='Untimed iterations per visitor before each stage.')
+    run_parser.add_argument('--workers', type=int, default=2)
+    run_parser.add_argument('--connections', type=int, default=8)
+    run_parser.add_argument('--seconds', type=float, default=10, help='Duration of each stage.')
+    run_parser.add_argument('--port', type=int, default=8103)
+    run_parser.add_argument('--replicas', type=int, default=0,
+                            help='Read replicas to route reads to (default: none).')
+    run_parser.add_argument('--replica-interval', type=float, default=2,
+                            help='Seconds between replica refreshes.')
+    run_parser.add_argument('--output', help='Results file (default: benchmarks/results/).')
+
+    compare_parser = commands.add_parser('compare', help='Compare two results files.')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=10,
+                                help='Percent change reported as a regression.')
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        seed(args.database, args.packages, args.users, args.bookings, args.seed)
+    elif args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args.old, args.new, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# Load test: the sync Flask JSON endpoint under gunicorn vs the ASGI catalog
+# API under uvicorn, with the same number of worker processes and many
+# concurrent keep-alive connections.
+#
+#   python benchmarks/bench_catalog_api.py [connections] [seconds] [workers]
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'bench.db')
+
+import app as travel  # noqa: E402
+
+SERVERS = [
+    ('flask/gunicorn sync', 8101, '/api/packages?per_page=20',
+     ['gunicorn', '-w', '{workers}', '-b', '127.0.0.1:{port}', 'app:app']),
+    ('asgi/uvicorn', 8102, '/v1/packages?per_page=20',
+     ['uvicorn', 'catalog_api:api', '--workers', '{workers}', '--port', '{port}',
+      '--log-level', 'warning', '--no-access-log']),
+]
+
+
+async def request(port, path, conn):
+    if conn is None:
+        conn = await asyncio.open_connection('127.0.0.1', port)
+    reader, writer = conn
+    writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path).encode('ascii'))
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    close = False
+    chunked = False
+    for line in head.lower().split(b'\r\n')[1:]:
+        if line.startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+        elif line.startswith(b'connection:') and b'close' in line:
+            close = True
+        elif line.startswith(b'transfer-encoding:') and b'chunked' in line:
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    else:
+        await reader.read()
+        close = True
+    if close:
+        writer.close()
+        conn = None
+    return status, conn
+
+
+async def load(port, path, connections, seconds):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        nonlocal errors
+        conn = None
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, conn = await request(port, path, conn)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                conn = None
+                continue
+            if status != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+        if conn is not None:
+            conn[1].close()
+
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return latencies, errors
+
+
+def wait_for(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            asyncio.run(request(port, '/', None))
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit('server on port %d did not start' % port)
+
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    workers = sys.argv[3] if len(sys.argv) > 3 else '2'
+    travel.init_db()
+
+    print('%d connections, %.0fs, %s workers' % (connections, seconds, workers))
+    print('%-22s %10s %9s %9s %9s %7s' % ('server', 'req/s', 'p50 ms', 'p99 ms', 'max ms', 'errors'))
+    for name, port, path, command in SERVERS:
+        command = [part.format(workers=workers, port=port) for part in command]
+        server = subprocess.Popen(command, cwd=ROOT, env=os.environ.copy())
+        try:
+            wait_for(port)
+            latencies, errors = asyncio.run(load(port, path, connections, seconds))
+        finally:
+            server.terminate()
+            server.wait()
+        latencies.sort()
+        count = len(latencies) or 1
+        print('%-22s %10.0f %9.2f %9.2f %9.2f %7d' % (
+            name, len(latencies) / seconds, latencies[count // 2] * 1e3 if latencies else 0,
+            latencies[int(count * 0.99)] * 1e3 if latencies else 0,
+            latencies[-1] * 1e3 if latencies else 0, errors))
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
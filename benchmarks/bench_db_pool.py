@@ -0,0 +1,75 @@
+# Compares the old connect-per-request pattern with the pooled connections
+# on the queries behind `/` and `/search`.
+#
+#   python benchmarks/bench_db_pool.py [iterations]
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'bench.db')
+shutil.copy(os.path.join(ROOT, 'travel_booking.db'), os.environ['DATABASE_PATH'])
+
+import app as travel  # noqa: E402
+
+HOME_QUERIES = [
+    ('SELECT * FROM packages WHERE featured = 1 ORDER BY created_at DESC LIMIT 6', ()),
+    ('SELECT * FROM packages ORDER BY created_at DESC', ()),
+]
+SEARCH_QUERIES = [
+    ('SELECT * FROM packages WHERE 1=1 AND (destination LIKE ? OR title LIKE ?) ORDER BY price ASC',
+     ('%Brasil%', '%Brasil%')),
+]
+
+
+def per_request_connect(queries):
+    conn = sqlite3.connect(os.environ['DATABASE_PATH'])
+    cursor = conn.cursor()
+    for sql, params in queries:
+        cursor.execute(sql, params)
+        cursor.fetchall()
+    conn.close()
+
+
+def pooled(queries):
+    conn = travel.db_pool.acquire()
+    cursor = conn.cursor()
+    for sql, params in queries:
+        cursor.execute(sql, params)
+        cursor.fetchall()
+    travel.db_pool.release(conn)
+
+
+def timeit(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    travel.init_db()
+    client = travel.app.test_client()
+
+    print('%-28s %12s' % ('case', 'us/op'))
+    for name, queries in (('home', HOME_QUERIES), ('search', SEARCH_QUERIES)):
+        print('%-28s %12.1f' % (name + ' connect-per-request',
+                                timeit(lambda: per_request_connect(queries), iterations)))
+        print('%-28s %12.1f' % (name + ' pooled',
+                                timeit(lambda: pooled(queries), iterations)))
+    for path in ('/', '/search?destination=Brasil'):
+        print('%-28s %12.1f' % ('GET ' + path,
+                                timeit(lambda: client.get(path), iterations // 10)))
+    print('pool:', travel.db_pool.stats())
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# Package image cache: renders the home and detail pages of the seeded
+# catalog, then requests every image they link to, cold (fetch + resize)
+# and warm (from disk). Runs offline: each package gets a generated JPEG
+# fixture standing in for its remote photo, at the size the CDN serves.
+#
+#   python benchmarks/bench_images.py [packages] [width]
+import os
+import re
+import sys
+import tempfile
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'bench.db')
+os.environ['IMAGE_CACHE_DIR'] = os.path.join(tmpdir, 'cache')
+os.environ['IMAGE_FIXTURE_DIR'] = os.path.join(tmpdir, 'fixtures')
+os.environ['METRICS_SQL'] = '0'
+os.environ['PASSWORD_WORKERS'] = '0'
+
+from PIL import Image  # noqa: E402
+
+import app as travel  # noqa: E402
+
+
+def make_fixtures(count, width):
+    os.makedirs(os.environ['IMAGE_FIXTURE_DIR'])
+    conn = travel.db_pool.connect()
+    urls = [row[0] for row in conn.execute('SELECT image_url FROM packages')]
+    # Clone the seed packages until there are `count`, each with its own photo
+    columns = [d[0] for d in conn.execute('SELECT * FROM packages').description if d[0] != 'id']
+    for i in range(len(urls), count):
+        conn.execute('INSERT INTO packages (%s) SELECT %s FROM packages WHERE id = 1' % (
+            ', '.join(columns), ', '.join(columns)))
+        conn.execute('UPDATE packages SET image_url = ?, featured = 1 WHERE id = last_insert_rowid()',
+                     ('https://images.example.com/photo-%d.jpeg' % i,))
+    conn.commit()
+    total = 0
+    for i, (url,) in enumerate(conn.execute('SELECT image_url FROM packages')):
+        # Smooth noise compresses roughly like a photo
+        image = Image.effect_noise((width // 8, width // 12), 64 + i % 32).convert('RGB')
+        image = image.resize((width, width * 2 // 3), Image.Resampling.BICUBIC)
+        path = os.path.join(os.environ['IMAGE_FIXTURE_DIR'],
+                            os.path.basename(urllib.parse.urlsplit(url).path))
+        image.save(path, 'JPEG', quality=85)
+        total += os.path.getsize(path)
+    conn.close()
+    travel.catalog.invalidate()
+    return total
+
+
+def image_links(client):
+    pages = ['/'] + ['/package/%d' % package.id for package in travel.catalog.get().ordered]
+    links = set()
+    for page in pages:
+        html = client.get(page).get_data(as_text=True)
+        for srcset in re.findall(r'srcset="([^"]+)"', html):
+            links.update(item.split()[0] for item in srcset.split(', '))
+    return sorted(links)
+
+
+def timed_fetch(client, links, label):
+    size = 0
+    timings = []
+    for link in links:
+        start = time.perf_counter()
+        response = client.get(link)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, (link, response.status_code)
+        size += len(response.data)
+    timings.sort()
+    print('%-6s %4d images %8.0f KiB  p50 %6.1fms  p95 %6.1fms  total %6.2fs' % (
+        label, len(links), size / 1024, timings[len(timings) // 2] * 1000,
+        timings[int(len(timings) * 0.95)] * 1000, sum(timings)))
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 800
+    travel.init_db()
+    source_bytes = make_fixtures(count, width)
+    print('%d packages, %d KiB of %dpx source photos' % (
+        len(travel.catalog.get().ordered), source_bytes / 1024, width))
+
+    client = travel.app.test_client()
+    links = image_links(client)
+    timed_fetch(client, links, 'cold')
+    timed_fetch(client, links, 'warm')
+
+    # What a desktop browser downloads for the home page: the 1x card of
+    # each featured package, against the full photos it used to load
+    featured = travel.catalog.get().featured
+    cards = [link for link in links if link.endswith('/card-400.webp')
+             and int(link.split('/')[2]) in {package.id for package in featured}]
+    card_bytes = sum(len(client.get(link).data) for link in cards)
+    photo_bytes = sum(os.path.getsize(os.path.join(
+        os.environ['IMAGE_FIXTURE_DIR'],
+        os.path.basename(urllib.parse.urlsplit(package.image_url).path))) for package in featured)
+    print('home page images: %d KiB as cards vs %d KiB as source photos' % (
+        card_bytes / 1024, photo_bytes / 1024))
+    print(travel.image_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Bulk package import and export: inserts a synthetic season from CSV and
+# JSON Lines, re-imports it as updates (and once more unchanged), then
+# streams the table back out.
+#
+#   python benchmarks/bench_import.py [rows] [batch_size]
+import csv
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'bench.db')
+os.environ['METRICS_SQL'] = '0'
+
+import app as travel  # noqa: E402
+
+CITIES = ['Cancún', 'Rio de Janeiro', 'Paris', 'Orlando', 'Maldivas', 'Búzios',
+          'Cusco', 'Nova York', 'Gramado', 'Lisboa', 'Roma', 'Bariloche']
+CATEGORIES = ['praia', 'cidade', 'aventura', 'família', 'romântico', 'lua-de-mel']
+WORDS = ['praia', 'resort', 'trilha', 'cachoeira', 'museu', 'gastronomia', 'mergulho',
+         'passeio', 'spa', 'neve', 'vinho', 'história', 'família', 'romântico']
+
+
+def make_rows(count, first_id=None, markup=1.0):
+    rng = random.Random(42)
+    for i in range(count):
+        city = rng.choice(CITIES)
+        yield {
+            'id': '' if first_id is None else first_id + i,
+            'title': 'Pacote %s %d' % (city, i), 'destination': city,
+            'description': ' '.join(rng.choice(WORDS) for _ in range(30)),
+            'price': '%.2f' % (rng.uniform(500, 9000) * markup), 'duration': rng.randint(3, 14),
+            'category': rng.choice(CATEGORIES), 'image_url': 'https://example.com/%d.jpg' % i,
+            'includes': ', '.join(rng.sample(WORDS, 4)), 'hotel': 'Hotel %d' % i,
+            'transport': 'Aéreo', 'featured': int(rng.random() < 0.01),
+        }
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = None
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+
+
+def write_jsonl(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def timed_import(label, path, batch_size):
+    conn = travel.db_pool.connect()
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        report = travel.import_package_rows(conn, f, travel.file_format(path), batch_size)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    print('%-22s %8d rows %7.2fs %9.0f rows/s  %d rejected' % (
+        label, report['imported'], elapsed, report['imported'] / elapsed, report['failed']))
+
+
+def timed_export(table, fmt):
+    conn = travel.db_pool.connect()
+    start = time.perf_counter()
+    size = 0
+    for chunk in travel.export_lines(conn, table, fmt):
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    print('export %-8s %-5s %8.1f MB %7.2fs' % (table, fmt, size / 1e6, elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    travel.init_db()
+    first_id = travel.db_pool.connect().execute('SELECT MAX(id) FROM packages').fetchone()[0] + 1
+
+    csv_path = os.path.join(tmpdir, 'season.csv')
+    jsonl_path = os.path.join(tmpdir, 'season.jsonl')
+    write_csv(csv_path, make_rows(count))
+    write_jsonl(jsonl_path, make_rows(count, first_id, markup=1.1))
+
+    timed_import('csv insert', csv_path, batch_size)
+    timed_import('jsonl update by id', jsonl_path, batch_size)
+    timed_import('jsonl unchanged', jsonl_path, batch_size)
+    for fmt in ('csv', 'jsonl'):
+        timed_export('packages', fmt)
+    # ru_maxrss is in kilobytes on Linux
+    print('peak RSS %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == '__main__':
+    main()
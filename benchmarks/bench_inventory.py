@@ -0,0 +1,107 @@
+# Availability lookups (segment tree vs SQL range scan) and contention on a
+# single popular departure.
+#
+#   python benchmarks/bench_inventory.py [threads] [capacity]
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'bench.db')
+
+import app as travel  # noqa: E402
+
+FIRST_DAY = date(2030, 1, 1)
+DAYS = 730
+PACKAGE_ID = 1
+
+
+def seed(capacity):
+    conn = travel.db_pool.connect()
+    conn.executemany('''
+        INSERT INTO package_inventory (package_id, day, capacity) VALUES (?, ?, ?)
+    ''', [(PACKAGE_ID, (FIRST_DAY + timedelta(days=i)).isoformat(), capacity)
+          for i in range(DAYS)])
+    conn.commit()
+    conn.close()
+
+
+def bench_lookups(iterations=20000):
+    inventory = travel.inventory_index.get(PACKAGE_ID)
+    conn = travel.db_pool.connect()
+    stays = [(FIRST_DAY + timedelta(days=i % (DAYS - 14)),
+              FIRST_DAY + timedelta(days=i % (DAYS - 14) + 7)) for i in range(iterations)]
+
+    start = time.perf_counter()
+    for check_in, check_out in stays:
+        inventory.available(check_in, check_out, 2)
+    tree_us = (time.perf_counter() - start) / iterations * 1e6
+
+    start = time.perf_counter()
+    for check_in, check_out in stays:
+        conn.execute('''
+            SELECT COUNT(*), MIN(capacity - reserved) FROM package_inventory
+            WHERE package_id = ? AND day >= ? AND day < ?
+        ''', (PACKAGE_ID, check_in.isoformat(), check_out.isoformat())).fetchone()
+    sql_us = (time.perf_counter() - start) / iterations * 1e6
+    conn.close()
+    print('7-night lookup: tree %.2f us, sql %.2f us' % (tree_us, sql_us))
+
+
+def bench_contention(threads, capacity):
+    check_in, check_out = '2030-07-01', '2030-07-08'
+    sold = []
+    latencies = []
+    lock = threading.Lock()
+
+    def buyer():
+        conn = travel.db_pool.connect()
+        while True:
+            started = time.perf_counter()
+            ok = travel.run_transaction(
+                conn, lambda cursor: travel.reserve_seats(cursor, PACKAGE_ID, check_in, check_out, 1),
+                retries=50)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    break
+                sold.append(1)
+        conn.close()
+
+    workers = [threading.Thread(target=buyer) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    conn = travel.db_pool.connect()
+    reserved = conn.execute('''
+        SELECT MAX(reserved) FROM package_inventory WHERE package_id = ? AND day >= ? AND day < ?
+    ''', (PACKAGE_ID, check_in, check_out)).fetchone()[0]
+    conn.close()
+    latencies.sort()
+    print('%d threads sold %d/%d seats in %.2fs (%.0f reservations/s), oversold: %s'
+          % (threads, len(sold), capacity, elapsed, len(sold) / elapsed, reserved > capacity))
+    print('reservation latency p50 %.2f ms, p99 %.2f ms'
+          % (latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3))
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    travel.init_db()
+    seed(capacity)
+    bench_lookups()
+    bench_contention(threads, capacity)
+
+
+if __name__ == '__main__':
+    main()
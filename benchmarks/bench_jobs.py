@@ -0,0 +1,75 @@
+# Job queue throughput: enqueues booking confirmation jobs the way checkout
+# does (one write transaction each, next to the booking), then drains the
+# queue with 1, 2 and 4 `flask run-jobs --once` processes writing to a
+# temporary mail outbox.
+#
+#   python benchmarks/bench_jobs.py [jobs]
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'bench.db')
+os.environ['MAIL_OUTBOX'] = os.path.join(tmpdir, 'outbox')
+os.environ['METRICS_SQL'] = '0'
+os.environ['PASSWORD_WORKERS'] = '0'
+
+import app as travel  # noqa: E402
+
+
+def enqueue(conn, count):
+    # One booking per checkout batch, each with its confirmation job
+    user_id = conn.execute('SELECT id FROM users LIMIT 1').fetchone()[0]
+    started = time.perf_counter()
+    for i in range(count):
+        token = 'bench-%d-%d' % (time.time_ns(), i)
+
+        def work(cursor):
+            cursor.execute('''
+                INSERT INTO bookings (user_id, package_id, travelers, check_in, check_out,
+                                      total_price, payment_method, payment_installments,
+                                      status, batch_token)
+                VALUES (?, 1, 2, '2030-01-01', '2030-01-05', 1000, 'pix', 1, 'confirmed', ?)
+            ''', (user_id, token))
+            travel.job_queue.enqueue(cursor, 'booking_confirmation', {'batch': token})
+        travel.run_transaction(conn, work)
+    return time.perf_counter() - started
+
+
+def drain(workers):
+    started = time.perf_counter()
+    processes = [subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'run-jobs',
+                                   '--once'], cwd=ROOT, stdout=subprocess.PIPE, text=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.communicate()
+    return time.perf_counter() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    travel.init_db()
+    conn = travel.db_pool.connect()
+    for workers in (1, 2, 4):
+        conn.execute('DELETE FROM jobs')
+        conn.commit()
+        elapsed = enqueue(conn, count)
+        print('enqueue        %6d jobs  %7.0f/s  %6.3fms per checkout transaction' % (
+            count, count / elapsed, elapsed / count * 1000))
+        elapsed = drain(workers)
+        left = sum(travel.job_queue.counts(conn).values())
+        print('drain %d worker%s %6d jobs  %7.0f/s  %d left' % (
+            workers, ' ' if workers == 1 else 's', count, count / elapsed, left))
+    print('%d messages in %s' % (len(glob.glob(os.path.join(os.environ['MAIL_OUTBOX'], '*.eml'))),
+                                 os.environ['MAIL_OUTBOX']))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
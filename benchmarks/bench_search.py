@@ -0,0 +1,89 @@
+# Compares the old LIKE scan used by /search with the FTS5 index on a
+# synthetic catalog: the first page of 24 results with its total, without
+# and with the price filter.
+#
+#   python benchmarks/bench_search.py [packages] [iterations]
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'bench.db')
+
+import app as travel  # noqa: E402
+
+CITIES = ['Cancún', 'Rio de Janeiro', 'Paris', 'Orlando', 'Maldivas', 'Búzios',
+          'Cusco', 'Nova York', 'Gramado', 'Lisboa', 'Roma', 'Bariloche']
+SYLLABLES = ['ca', 'ma', 'ri', 'to', 'lu', 'ne', 'sa', 'pe', 'do', 'vi', 'ga', 'bo']
+WORDS = ['praia', 'resort', 'trilha', 'cachoeira', 'museu', 'gastronomia', 'mergulho',
+         'passeio', 'spa', 'neve', 'vinho', 'história', 'família', 'romântico']
+TERMS = ['cancun', 'Paris', 'rio', 'gastronomia', 'buzios spa', 'neve', '12345']
+# Descriptions draw mostly from a large filler vocabulary so the themed
+# words are about as selective as they are in a real catalog.
+FILLER = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+LIKE_SQL = '''
+    SELECT * FROM packages WHERE 1=1 AND (destination LIKE ? OR title LIKE ?)
+    AND price >= ? AND price <= ?
+    ORDER BY price ASC
+'''
+PAGE = 24
+
+
+def seed(count):
+    rng = random.Random(42)
+    conn = travel.db_pool.connect()
+    rows = []
+    for i in range(count):
+        city = rng.choice(CITIES)
+        text = ' '.join(rng.choice(FILLER) for _ in range(40)) + ' ' + rng.choice(WORDS)
+        rows.append(('Pacote %s %d' % (city, i), city, text, rng.uniform(500, 9000),
+                     rng.randint(3, 14), 'praia', 'https://example.com/%d.jpg' % i,
+                     ', '.join(rng.sample(WORDS, 4)), 'Hotel %d' % i, 'Aéreo', 0))
+    conn.executemany('''
+        INSERT INTO packages (title, destination, description, price, duration, category,
+                              image_url, includes, hotel, transport, featured)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def bench(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for term in TERMS:
+            fn(term)
+    return (time.perf_counter() - start) / (iterations * len(TERMS)) * 1e3
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    travel.init_db()
+    seed(count)
+    conn = travel.db_pool.connect()
+
+    def like(term, min_price=0, max_price=1e9):
+        pattern = '%' + term + '%'
+        return conn.execute(LIKE_SQL, (pattern, pattern, min_price, max_price)).fetchall()
+
+    def fts(term, min_price=None, max_price=None):
+        return travel.search_package_page(conn, term, None, min_price, max_price, 0, PAGE)[1]
+
+    for term in TERMS:
+        print('%-14s like=%6d  fts=%6d' % (term, len(like(term)), fts(term)))
+    print('packages: %d' % (count + 10))
+    print('LIKE scan         : %8.2f ms/query' % bench(like, iterations))
+    print('FTS5 bm25 page    : %8.2f ms/query' % bench(fts, iterations))
+    print('LIKE, price range : %8.2f ms/query' % bench(lambda t: like(t, 1000, 3000), iterations))
+    print('FTS5, price range : %8.2f ms/query' % bench(lambda t: fts(t, 1000, 3000), iterations))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# Read-only JSON catalog API for the mobile app and partner aggregators,
+# served by an ASGI server next to the Flask site:
+#
+#   uvicorn catalog_api:api --workers 2 --port 8001
+#
+#   GET /v1/packages                  newest first, keyset paginated
+#   GET /v1/packages/featured
+#   GET /v1/packages/search           q, category, min_price, max_price
+#   GET /v1/packages/<id>
+#
+# Every endpoint takes ?fields=id,title,price to trim the payload. Listings
+# come from the same per-process CatalogSnapshot as the HTML pages; anything
+# that may touch SQLite runs on a small bounded thread pool, so the event
+# loop only parses requests and writes bytes while idle connections cost
+# nothing but a socket. With DATABASE_REPLICAS set, reads use a replica
+# that holds the latest catalog write.
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as travel
+import repository
+
+API_THREADS = int(os.environ.get('CATALOG_API_THREADS', travel.app.config['DB_POOL_SIZE']))
+API_MAX_PENDING = int(os.environ.get('CATALOG_API_MAX_PENDING', 256))
+
+# Listings are served from PackageCard records, detail from Package
+LIST_FIELDS = ('id', 'title', 'destination', 'summary', 'price', 'duration', 'category',
+               'image_url', 'featured')
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class Query:
+    def __init__(self, query_string):
+        self.args = {k: v[-1] for k, v in parse_qs(query_string.decode('latin-1')).items()}
+
+    def get(self, name, default=None):
+        return self.args.get(name, default)
+
+    def per_page(self, default, maximum=100):
+        try:
+            size = int(self.args.get('per_page', default))
+        except ValueError:
+            return default
+        return max(1, min(size, maximum))
+
+    def cursor(self, types):
+        token = self.args.get('cursor')
+        if not token:
+            return None
+        values = travel.decode_cursor(token, types)
+        if values is None:
+            raise ApiError(400, 'invalid cursor')
+        return values
+
+    def fields(self, default, allowed=repository.PackageCard.FIELDS):
+        requested = self.args.get('fields')
+        if not requested:
+            return default
+        names = tuple(name.strip() for name in requested.split(',') if name.strip())
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise ApiError(400, 'unknown fields: %s' % ', '.join(unknown))
+        return names
+
+def project(records, fields):
+    return [{name: getattr(record, name) for name in fields} for record in records]
+
+def page_body(rows, fields, next_cursor, total=None):
+    body = {'packages': project(rows, fields), 'next': next_cursor}
+    if total is not None:
+        body['total'] = total
+    return body
+
+# Handlers run on the executor threads and return a JSON-able body
+def list_packages(query):
+    snapshot = travel.catalog.get()
+    page, next_cursor = travel.seek_page(snapshot.ordered, travel.listing_key,
+                                         query.cursor(travel.LISTING_CURSOR),
+                                         query.per_page(50), descending=True)
+    return page_body(page, query.fields(LIST_FIELDS), next_cursor)
+
+def featured_packages(query):
+    return page_body(travel.catalog.get().featured, query.fields(LIST_FIELDS), None)
+
+def package_detail(query, package_id):
+    fields = query.fields(repository.Package.FIELDS, repository.Package.FIELDS)
+    pool = travel.read_pool(travel.catalog.changed_at())
+    conn = pool.acquire()
+    try:
+        package = repository.get_package(conn, package_id)
+    finally:
+        pool.release(conn)
+    if package is None:
+        raise ApiError(404, 'package not found')
+    return project([package], fields)[0]
+
+def search_packages(query):
+    fields = query.fields(LIST_FIELDS)
+    per_page = query.per_page(50)
+    snapshot = travel.catalog.get()
+    text = (query.get('q') or '').strip()
+    category = query.get('category')
+    min_price = travel._parse_price(query.get('min_price'))
+    max_price = travel._parse_price(query.get('max_price'))
+    ranked = None
+    if travel.fts_query(text):
+        # Same as /search: relevance order pages by position
+        start = query.cursor(travel.OFFSET_CURSOR)
+        start = max(0, start[0]) if start else 0
+        pool = travel.read_pool(travel.catalog.changed_at())
+        conn = pool.acquire()
+        try:
+            ranked = travel.search_package_page(conn, text, category, min_price, max_price,
+                                                start, per_page)
+        finally:
+            pool.release(conn)
+
+    if ranked is not None:
+        ids, total = ranked
+        page = [snapshot.by_id[i] for i in ids if i in snapshot.by_id]
+        next_cursor = travel.encode_cursor(start + per_page) if start + per_page < total else None
+    else:
+        packages = snapshot.by_price
+        if category:
+            packages = [p for p in packages if p.category == category]
+        if min_price is not None:
+            packages = [p for p in packages if p.price >= min_price]
+        if max_price is not None:
+            packages = [p for p in packages if p.price <= max_price]
+        total = len(packages)
+        page, next_cursor = travel.seek_page(packages, travel.price_key,
+                                             query.cursor(travel.PRICE_CURSOR), per_page)
+    return page_body(page, fields, next_cursor, total=total)
+
+def route(path):
+    parts = path.strip('/').split('/')
+    if len(parts) < 2 or parts[0] != 'v1' or parts[1] != 'packages':
+        return None
+    if len(parts) == 2:
+        return list_packages, ()
+    if len(parts) == 3:
+        if parts[2] == 'featured':
+            return featured_packages, ()
+        if parts[2] == 'search':
+            return search_packages, ()
+        if parts[2].isdigit():
+            return package_detail, (int(parts[2]),)
+    return None
+
+class CatalogApi:
+    def __init__(self, threads, max_pending):
+        self.threads = threads
+        self.max_pending = max_pending
+        self._executor = None
+        self._slots = None
+
+    def _start(self):
+        # Created lazily so each uvicorn worker gets its own pool and its
+        # semaphore binds to the worker's event loop
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='catalog-api')
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+    def _stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    self._start()
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self._stop()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+        self._start()
+        status, body, etag = await self.handle(scope)
+        headers = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(body)).encode('ascii'))]
+        if etag:
+            headers.append((b'etag', etag))
+            headers.append((b'cache-control', b'public, max-age=30'))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body',
+                    'body': b'' if scope['method'] == 'HEAD' else body})
+
+    async def handle(self, scope):
+        if scope['method'] not in ('GET', 'HEAD'):
+            return 405, b'{"error":"method not allowed"}', None
+        target = route(scope['path'])
+        if target is None:
+            return 404, b'{"error":"not found"}', None
+        handler, args = target
+        if self._slots.locked():
+            return 503, b'{"error":"busy"}', None
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, handler, Query(scope['query_string']), *args)
+            except ApiError as e:
+                result = {'error': e.message}
+                return e.status, json.dumps(result, separators=(',', ':')).encode('utf-8'), None
+            except Exception:
+                # Never let a handler bug escape the ASGI app
+                travel.app.logger.exception('Catalog API error on %s', scope['path'])
+                return 500, b'{"error":"internal error"}', None
+        body = json.dumps(result, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        etag = b'"' + hashlib.md5(body).hexdigest().encode('ascii') + b'"'
+        for name, value in scope['headers']:
+            if name == b'if-none-match' and etag in value:
+                return 304, b'', etag
+        return 200, body, etag
+
+api = CatalogApi(API_THREADS, API_MAX_PENDING)
@@ -0,0 +1,282 @@
+# Local copies of package images. Each remote image_url is fetched once and
+# kept with its resized variants in a content-addressed tree under the cache
+# directory:
+#
+#   urls/ab/<url key>             digest of the bytes fetched for that URL
+#   cd/<digest>/source            the original, to render further variants
+#   cd/<digest>/card-400.webp     one file per variant and width
+#
+# Identical images behind different URLs share one entry. Files are written
+# atomically, so worker processes can share the directory. When it grows past
+# its byte budget the least recently used files go first (mtime, refreshed at
+# most every touch_interval on reads); the small url pointers are never
+# evicted, and a variant whose source was evicted is fetched again.
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+# name: (aspect width, aspect height, widths offered in srcset)
+VARIANTS = {
+    'thumb': (1, 1, (48, 96)),
+    'card': (2, 1, (400, 800)),
+    'detail': (2, 1, (800, 1200)),
+}
+
+POINTER_DIR = 'urls'
+# Seconds before a URL that failed to fetch or decode is tried again
+FAILURE_TTL = 300
+
+class ImageError(Exception):
+    pass
+
+def url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:24]
+
+def fetch_url(url, timeout=10.0, max_bytes=10 * 1024 * 1024):
+    if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+        raise ImageError('unsupported image URL: %s' % url)
+    request = urllib.request.Request(url, headers={'User-Agent': 'travel-booking-images'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ImageError('image larger than %d bytes: %s' % (max_bytes, url))
+    return data
+
+def fixture_fetcher(directory):
+    # Offline stand-in for fetch_url: serves <directory>/<last path segment>
+    def fetch(url):
+        name = os.path.basename(urllib.parse.urlsplit(url).path)
+        try:
+            with open(os.path.join(directory, name), 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise ImageError('no fixture for %s: %s' % (url, e))
+    return fetch
+
+def render_variant(data, variant, width, quality=80):
+    ratio_w, ratio_h, _ = VARIANTS[variant]
+    height = round(width * ratio_h / ratio_w)
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEGs decode straight at a reduced scale when the target is small
+        image.draft('RGB', (max(width, height), max(width, height)))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        # Crop like object-cover, but never upscale a small source
+        scale = min(1.0, image.width / width, image.height / height)
+        image = ImageOps.fit(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                             Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, 'WEBP', quality=quality, method=4)
+    return out.getvalue()
+
+class ImageCache:
+    def __init__(self, directory, budget, fetcher, quality=80, touch_interval=3600,
+                 warm_workers=2):
+        self.directory = directory
+        # Bytes kept on disk; 0 disables eviction
+        self.budget = budget
+        self.fetcher = fetcher
+        self.quality = quality
+        self.touch_interval = touch_interval
+        self.warm_workers = warm_workers
+        # Striped so one slow fetch doesn't hold up other images
+        self._fetch_locks = [threading.Lock() for _ in range(16)]
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._failures = {}
+        self._size = None
+        self._pid = None
+        self._executor = None
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.errors = 0
+        self.evicted = 0
+
+    def _pointer_path(self, key):
+        return os.path.join(self.directory, POINTER_DIR, key[:2], key)
+
+    def _entry_path(self, digest, name):
+        return os.path.join(self.directory, digest[:2], digest, name)
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._grow(len(data))
+
+    def _touch(self, path, st):
+        if time.time() - st.st_mtime > self.touch_interval:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    def variant_path(self, url, variant, width):
+        # Path of the rendered variant, fetching and rendering it if needed;
+        # raises ImageError when the source can't be fetched or decoded
+        key = url_key(url)
+        name = '%s-%d.webp' % (variant, width)
+        digest = self._read(self._pointer_path(key))
+        if digest:
+            path = self._entry_path(digest.decode('ascii'), name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                pass
+            else:
+                self.hits += 1
+                self._touch(path, st)
+                return path
+        self.misses += 1
+        with self._fetch_locks[int(key[:4], 16) % len(self._fetch_locks)]:
+            digest, source = self._source(key, url)
+            path = self._entry_path(digest, name)
+            if not os.path.exists(path):
+                try:
+                    self._write(path, render_variant(source, variant, width, self.quality))
+                except (OSError, ValueError, Image.DecompressionBombError) as e:
+                    self.errors += 1
+                    raise ImageError('cannot render %s: %s' % (url, e))
+        return path
+
+    def open_variant(self, url, variant, width):
+        # The variant opened for reading. Another worker may evict the file
+        # between variant_path and open, in which case it is rendered again;
+        # an open file stays readable after eviction.
+        for attempt in range(3):
+            path = self.variant_path(url, variant, width)
+            try:
+                return open(path, 'rb')
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise ImageError('%s keeps being evicted' % path)
+
+    def _source(self, key, url):
+        # (digest, bytes) of the original, from disk or fetched
+        digest = self._read(self._pointer_path(key))
+        if digest:
+            digest = digest.decode('ascii')
+            data = self._read(self._entry_path(digest, 'source'))
+            if data is not None:
+                return digest, data
+        failed = self._failures.get(key)
+        if failed is not None and time.monotonic() - failed < FAILURE_TTL:
+            raise ImageError('recently failed: %s' % url)
+        try:
+            data = self.fetcher(url)
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+        except Exception as e:
+            self.errors += 1
+            self._failed(key)
+            raise ImageError('cannot fetch %s: %s' % (url, e))
+        with self._lock:
+            self._failures.pop(key, None)
+        self.fetches += 1
+        digest = hashlib.sha256(data).hexdigest()
+        self._write(self._entry_path(digest, 'source'), data)
+        self._write(self._pointer_path(key), digest.encode('ascii'))
+        return digest, data
+
+    def _failed(self, key):
+        # Kept in failure order, so expired entries are dropped from the front
+        now = time.monotonic()
+        with self._lock:
+            self._failures.pop(key, None)
+            self._failures[key] = now
+            while True:
+                old_key, failed = next(iter(self._failures.items()))
+                if now - failed < FAILURE_TTL:
+                    break
+                del self._failures[old_key]
+
+    def warm(self, url):
+        # Renders every variant in the background, e.g. right after an admin
+        # saves a package, so the first visitor doesn't wait for the fetch
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads don't survive a fork
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(self.warm_workers,
+                                                    thread_name_prefix='image-warm')
+            executor = self._executor
+        return executor.submit(self._warm, url)
+
+    def _warm(self, url):
+        for variant, (_, _, widths) in VARIANTS.items():
+            for width in widths:
+                try:
+                    self.variant_path(url, variant, width)
+                except ImageError:
+                    return False
+        return True
+
+    def _grow(self, size):
+        if self.budget <= 0:
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry[1] for entry in self._files())
+            self._size += size
+            over = self._size > self.budget
+        if over:
+            self.evict()
+
+    def _files(self):
+        # (mtime, size, path) of every evictable file
+        for root, dirs, names in os.walk(self.directory):
+            if root == self.directory and POINTER_DIR in dirs:
+                dirs.remove(POINTER_DIR)
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def evict(self):
+        # Down to 90% of the budget so the next few writes don't rescan.
+        # Other workers' writes are counted here too: each scan starts over.
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            files = sorted(self._files())
+            total = sum(size for _, size, _ in files)
+            target = self.budget * 0.9
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evicted += 1
+            with self._lock:
+                self._size = total
+        finally:
+            self._evict_lock.release()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'fetches': self.fetches,
+                'errors': self.errors, 'evicted': self.evicted, 'bytes': self._size,
+                'budget': self.budget}
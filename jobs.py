@@ -0,0 +1,173 @@
+# Durable job queue in the application's SQLite database (the jobs table).
+# Jobs are enqueued with the cursor of the transaction that makes them
+# necessary, so a booking and its follow-up work commit or roll back
+# together. Workers claim jobs in batches under a lease: a claimed job's
+# run_at moves to the end of the lease, so a job whose worker died becomes
+# claimable again once the lease runs out. Failures are retried with
+# exponential backoff; after max_attempts the job stays in the table as
+# 'dead' until someone requeues it. Finished jobs are deleted. Delivery is at
+# least once, so handlers must tolerate running twice.
+import json
+import random
+import secrets
+import threading
+import time
+import traceback
+
+class Job:
+    __slots__ = ('id', 'kind', 'payload', 'attempts', 'max_attempts', 'lease')
+
+    def __init__(self, id, kind, payload, attempts, max_attempts, lease):
+        self.id = id
+        self.kind = kind
+        self.payload = json.loads(payload)
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+    def __repr__(self):
+        return '<Job %s %s>' % (self.id, self.kind)
+
+class JobQueue:
+    def __init__(self, transaction, lease=60.0, max_attempts=5, backoff=5.0, max_backoff=3600.0):
+        # transaction(conn, work) runs work(cursor) in a write transaction
+        self.transaction = transaction
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def enqueue(self, cursor, kind, payload, delay=0.0, max_attempts=None):
+        # Call inside the caller's transaction; nothing runs until it commits
+        cursor.execute('''
+            INSERT INTO jobs (kind, payload, run_at, max_attempts) VALUES (?, ?, ?, ?)
+        ''', (kind, json.dumps(payload, separators=(',', ':')), time.time() + delay,
+              max_attempts or self.max_attempts))
+        return cursor.lastrowid
+
+    def claim(self, conn, limit=10):
+        # Leases up to `limit` due jobs, oldest first, including running jobs
+        # whose lease has expired
+        lease = secrets.token_hex(8)
+
+        def work(cursor):
+            now = time.time()
+            cursor.execute('''
+                UPDATE jobs SET status = 'running', run_at = ?, lease = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM jobs
+                    WHERE status IN ('queued', 'running') AND run_at <= ?
+                    ORDER BY run_at LIMIT ?
+                )
+                RETURNING id, kind, payload, attempts, max_attempts
+            ''', (now + self.lease, lease, now, limit))
+            return [Job(*row, lease) for row in cursor.fetchall()]
+        return sorted(self.transaction(conn, work), key=lambda job: job.id)
+
+    def complete(self, conn, done):
+        # Deletes finished jobs in one transaction; returns the ones whose
+        # lease ran out, which another worker may have run again
+        def work(cursor):
+            lost = []
+            for job in done:
+                cursor.execute('DELETE FROM jobs WHERE id = ? AND lease = ?', (job.id, job.lease))
+                if cursor.rowcount != 1:
+                    lost.append(job)
+            return lost
+        return self.transaction(conn, work) if done else []
+
+    def fail(self, conn, job, error):
+        # Schedules a retry, or dead-letters the job after its last attempt;
+        # returns 'retry' or 'dead'
+        if job.attempts >= job.max_attempts:
+            outcome, delay = 'dead', 0.0
+        else:
+            outcome = 'retry'
+            delay = min(self.max_backoff, self.backoff * 2 ** (job.attempts - 1))
+            delay *= random.uniform(0.5, 1.5)
+
+        def work(cursor):
+            cursor.execute('''
+                UPDATE jobs SET status = ?, run_at = ?, lease = NULL, last_error = ?
+                WHERE id = ? AND lease = ?
+            ''', ('dead' if outcome == 'dead' else 'queued', time.time() + delay, error,
+                  job.id, job.lease))
+        self.transaction(conn, work)
+        return outcome
+
+    def requeue_dead(self, conn, kind=None):
+        def work(cursor):
+            cursor.execute('''
+                UPDATE jobs SET status = 'queued', attempts = 0, run_at = ?
+                WHERE status = 'dead' AND (? IS NULL OR kind = ?)
+            ''', (time.time(), kind, kind))
+            return cursor.rowcount
+        return self.transaction(conn, work)
+
+    def lag(self, conn):
+        # Seconds the oldest due job has been waiting for a worker
+        now = time.time()
+        oldest = conn.execute('''
+            SELECT MIN(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?
+        ''', (now,)).fetchone()[0]
+        return now - oldest if oldest is not None else 0.0
+
+    def counts(self, conn):
+        # {(status, kind): jobs}
+        return {(status, kind): count for status, kind, count in conn.execute(
+            'SELECT status, kind, COUNT(*) FROM jobs GROUP BY status, kind')}
+
+class Worker:
+    # Runs jobs with handlers[kind](conn, payload) on its own connection.
+    # observer(kind, outcome, seconds) is told how every job ended.
+    def __init__(self, queue, conn, handlers, batch=10, poll=1.0, observer=None):
+        self.queue = queue
+        self.conn = conn
+        self.handlers = handlers
+        self.batch = batch
+        self.poll = poll
+        self.observer = observer
+        self.stopping = threading.Event()
+        self.processed = {'done': 0, 'retry': 0, 'dead': 0, 'lost': 0}
+
+    def run_once(self):
+        # Runs one claimed batch. Failures are recorded as they happen;
+        # successes together at the end, so a crash mid-batch runs the
+        # finished jobs again (delivery is at least once anyway).
+        jobs = self.queue.claim(self.conn, self.batch)
+        done = []
+        for job in jobs:
+            if self.stopping.is_set():
+                # The rest of the batch is picked up when its lease expires
+                break
+            started = time.perf_counter()
+            handler = self.handlers.get(job.kind)
+            try:
+                if handler is None:
+                    raise LookupError('no handler for job kind %r' % job.kind)
+                handler(self.conn, job.payload)
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                self._finish(job, self.queue.fail(self.conn, job, traceback.format_exc(limit=5)),
+                             time.perf_counter() - started)
+            else:
+                done.append((job, time.perf_counter() - started))
+        lost = self.queue.complete(self.conn, [job for job, _ in done])
+        for job, seconds in done:
+            self._finish(job, 'lost' if job in lost else 'done', seconds)
+        return len(jobs)
+
+    def _finish(self, job, outcome, seconds):
+        self.processed[outcome] += 1
+        if self.observer is not None:
+            self.observer(job.kind, outcome, seconds)
+
+    def run(self):
+        # Until stop(); waits `poll` seconds whenever the queue is empty
+        while not self.stopping.is_set():
+            if not self.run_once():
+                self.stopping.wait(self.poll)
+
+    def stop(self):
+        self.stopping.set()
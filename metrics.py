@@ -0,0 +1,241 @@
+# In-process metrics for app.py: counters and histograms rendered in the
+# Prometheus text format, a sqlite3 connection that times every statement,
+# and a keeper for the cProfile dumps of the slowest sampled requests.
+# Every worker process keeps its own numbers.
+import heapq
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name + _labels(self.labels, labels), value
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += 1
+            entry[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        for labels, entry in values:
+            for bound, count in zip(self.buckets, entry):
+                yield (self.name + '_bucket' + _labels(self.labels, labels, 'le="%g"' % bound),
+                       count)
+            yield self.name + '_bucket' + _labels(self.labels, labels, 'le="+Inf"'), entry[-2]
+            yield self.name + '_sum' + _labels(self.labels, labels), entry[-1]
+            yield self.name + '_count' + _labels(self.labels, labels), entry[-2]
+
+class Gauge:
+    # Read when /metrics is scraped; collect() returns {label values: value}
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels, collect):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield self.name + _labels(self.labels, labels), value
+
+class GaugeSet:
+    # Gauges read together: one collect() per scrape returns a
+    # {label values: value} for each gauge, in order, so they agree
+    def __init__(self, gauges, collect):
+        self.gauges = gauges
+        self.collect = collect
+
+    def families(self):
+        for (name, help, labels), values in zip(self.gauges, self.collect()):
+            yield Gauge(name, help, labels, lambda values=values: values)
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels, collect):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def gauge_set(self, gauges, collect):
+        # gauges: (name, help, labels) triples
+        return self.register(GaugeSet(gauges, collect))
+
+    def render(self):
+        lines = []
+        for family in self._families():
+            lines.append('# HELP %s %s' % (family.name, family.help))
+            lines.append('# TYPE %s %s' % (family.name, family.kind))
+            for sample, value in family.samples():
+                lines.append('%s %s' % (sample, repr(float(value)) if isinstance(value, float)
+                                        else value))
+        return '\n'.join(lines) + '\n'
+
+    def _families(self):
+        for metric in self._metrics:
+            if isinstance(metric, GaugeSet):
+                yield from metric.families()
+            else:
+                yield metric
+
+def statement_label(sql, limit=120):
+    # Collapse whitespace so the same literal always maps to one label
+    label = re.sub(r'\s+', ' ', sql).strip()
+    return label if len(label) <= limit else label[:limit - 3] + '...'
+
+class TimedCursor(sqlite3.Cursor):
+    # Reports (sql, seconds, rows, executed) to TimedConnection.observer for
+    # every execute and every fetch, so time spent stepping through a result
+    # set is charged to the statement that produced it.
+    _sql = None
+
+    def _report(self, start, rows, executed=False):
+        observer = TimedConnection.observer
+        if observer is not None and self._sql is not None:
+            observer(self._sql, time.perf_counter() - start, rows, executed)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        self._sql = sql
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._report(start, 0, True)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        self._sql = sql
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._report(start, 0, True)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._report(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._report(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._report(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._report(start, 0)
+            raise
+        self._report(start, 1)
+        return row
+
+class TimedConnection(sqlite3.Connection):
+    # Pass as sqlite3.connect(factory=TimedConnection); observer is set once
+    # by the application
+    observer = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class SlowestProfiles:
+    # Keeps the cProfile dumps of the `keep` slowest sampled requests of this
+    # process on disk; read them with `python -m pstats <file>`.
+    def __init__(self, directory, keep=10):
+        self.directory = directory
+        self.keep = keep
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def offer(self, seconds, profile, name):
+        with self._lock:
+            if len(self._heap) >= self.keep and seconds <= self._heap[0][0]:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, '%09.1fms-%s-%d-%d.prof' % (
+                seconds * 1000, re.sub(r'[^\w.]+', '_', name), os.getpid(), time.time_ns()))
+            profile.dump_stats(path)
+            heapq.heappush(self._heap, (seconds, path))
+            if len(self._heap) > self.keep:
+                _, evicted = heapq.heappop(self._heap)
+                try:
+                    os.remove(evicted)
+                except FileNotFoundError:
+                    pass
+            return path
+
+    def paths(self):
+        with self._lock:
+            return [path for _, path in sorted(self._heap, reverse=True)]
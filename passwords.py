@@ -0,0 +1,166 @@
+# Password hashing off the request thread. Werkzeug's hashes are meant to be
+# slow, so they run in a small pool of worker processes with a hard cap on
+# queued jobs: when the cap is reached callers get HasherBusy at once instead
+# of piling up behind a burst of logins. SlidingWindowLimiter throttles
+# attempts per key before any hash is computed. This module only imports
+# Werkzeug so the pool's worker processes start quickly.
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class HasherBusy(Exception):
+    pass
+
+def hash_method(password_hash):
+    # 'scrypt:32768:8:1$salt$hash' -> 'scrypt:32768:8:1'
+    return (password_hash or '').split('$', 1)[0]
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=2, max_queue=16, timeout=5.0):
+        self.method = method
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._current_method = None
+        self._reset()
+
+    def _reset(self):
+        # Like the connection pool, worker processes never cross a fork
+        self._pid = os.getpid()
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._executor is None:
+                # spawn: forking a threaded server process is not safe
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def submit(self, fn, *args):
+        # Returns a future, or raises HasherBusy when the queue is full
+        if self.workers <= 0:
+            raise ValueError('submit() needs worker processes')
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+        with self._lock:
+            self.in_flight += 1
+
+        def done(_):
+            with self._lock:
+                self.in_flight -= 1
+            slots.release()
+
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            done(None)
+            self._discard(executor)
+            raise HasherBusy()
+        future.add_done_callback(done)
+        return future
+
+    def _discard(self, executor):
+        # A worker died (OOM killer, segfault); start fresh on the next call
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        future = self.submit(fn, *args)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # The job keeps its slot until it finishes
+            self.rejected += 1
+            raise HasherBusy()
+        except BrokenProcessPool:
+            self._discard(self._executor)
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash_later(self, password):
+        # Future for a new hash, for work nobody is waiting on
+        if self.workers > 0:
+            return self.submit(generate_password_hash, password, self.method)
+        future = Future()
+        future.set_result(generate_password_hash(password, self.method))
+        return future
+
+    def needs_rehash(self, password_hash):
+        if self._current_method is None:
+            # Resolves defaults such as 'scrypt' to 'scrypt:32768:8:1' once
+            self._current_method = hash_method(generate_password_hash('', self.method))
+        return hash_method(password_hash) != self._current_method
+
+    def stats(self):
+        return {
+            'method': self.method,
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'rejected': self.rejected,
+        }
+
+class SlidingWindowLimiter:
+    # Sliding window counter: the previous fixed window's count is weighted by
+    # how much of it still overlaps the sliding window, so each key costs two
+    # integers. The oldest keys are dropped past max_keys, which bounds memory
+    # when an attack rotates through addresses or emails.
+    def __init__(self, limit, window=60.0, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def hit(self, key):
+        # Counts an attempt; False means over the limit (0 disables the limit)
+        if self.limit <= 0:
+            return True
+        now = time.monotonic()
+        current = int(now // self.window)
+        with self._lock:
+            window, count, previous = self._entries.pop(key, (current, 0, 0))
+            if window != current:
+                previous = count if window == current - 1 else 0
+                count = 0
+            overlap = 1 - (now % self.window) / self.window
+            allowed = previous * overlap + count < self.limit
+            if allowed:
+                count += 1
+            else:
+                self.throttled += 1
+            self._entries[key] = (current, count, previous)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+        return allowed
+
+    def stats(self):
+        return {'keys': len(self._entries), 'limit': self.limit, 'window': self.window,
+                'throttled': self.throttled}
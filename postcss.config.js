@@ -1,6 +1,11 @@
+import tailwindcss from 'tailwindcss';
+import autoprefixer from 'autoprefixer';
+import iconSubset from './scripts/postcss-icon-subset.js';
+
 export default {
-  plugins: {
-    tailwindcss: {},
-    autoprefixer: {},
-  },
+  plugins: [
+    iconSubset({ content: ['templates', 'assets', 'static/js'] }),
+    tailwindcss(),
+    autoprefixer(),
+  ],
 };
@@ -0,0 +1,196 @@
+# Data access for the booking site. Each query selects only the columns its
+# view renders and returns a compact __slots__ record, so templates read
+# package.title instead of package[1] and adding a column never shifts
+# anything. Records are plain value holders; writes stay in app.py.
+
+class Record:
+    __slots__ = ()
+    # Column order of the SELECTs below
+    FIELDS = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.FIELDS, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        return cls(*row)
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, getattr(self, 'id', '?'))
+
+class PackageCard(Record):
+    # Listing cards (home, search, admin table): no description blob, just
+    # the summary kept up to date by triggers
+    FIELDS = ('id', 'title', 'destination', 'summary', 'price', 'duration', 'category',
+              'image_url', 'featured', 'created_at', 'updated_at')
+    __slots__ = FIELDS
+
+class Package(PackageCard):
+    FIELDS = PackageCard.FIELDS + ('description', 'includes', 'hotel', 'transport')
+    __slots__ = ('description', 'includes', 'hotel', 'transport')
+
+class CartItem(Record):
+    FIELDS = ('id', 'package_id', 'travelers', 'check_in', 'check_out', 'title', 'destination',
+              'image_url', 'duration', 'price', 'subtotal')
+    __slots__ = FIELDS
+
+class Booking(Record):
+    FIELDS = ('id', 'package_id', 'travelers', 'check_in', 'check_out', 'total_price', 'status',
+              'created_at', 'title', 'destination', 'image_url')
+    __slots__ = FIELDS
+
+class BookingEmail(Record):
+    # One booking as the confirmation and cancellation emails show it
+    FIELDS = ('id', 'email', 'name', 'title', 'destination', 'check_in', 'check_out',
+              'travelers', 'total_price', 'payment_method', 'payment_installments')
+    __slots__ = FIELDS
+
+class CartSummary:
+    # Line totals and the grand total come from SQL; installments split the
+    # total the way the checkout form offers them
+    __slots__ = ('items', 'total', 'travelers', 'installments')
+    MAX_INSTALLMENTS = 12
+
+    def __init__(self, items, total, travelers):
+        self.items = items
+        self.total = round(total, 2)
+        self.travelers = travelers
+        self.installments = [(n, round(self.total / n, 2))
+                             for n in range(1, self.MAX_INSTALLMENTS + 1)]
+
+# User class for Flask-Login. It implements the UserMixin interface itself so
+# that __slots__ actually drops the per-instance __dict__.
+class User:
+    __slots__ = ('id', 'email', 'name', 'is_admin')
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, email, name, is_admin=False):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.is_admin = is_admin
+
+    def get_id(self):
+        return str(self.id)
+
+def _records(conn, cls, sql, params=()):
+    cursor = conn.cursor()
+    cursor.row_factory = cls.row_factory
+    return cursor.execute(sql, params)
+
+def package_cards(conn):
+    return _records(conn, PackageCard, '''
+        SELECT id, title, destination, summary, price, duration, category,
+               image_url, featured, created_at, updated_at
+        FROM packages ORDER BY created_at DESC, id DESC
+    ''').fetchall()
+
+def get_package(conn, package_id):
+    return _records(conn, Package, '''
+        SELECT id, title, destination, summary, price, duration, category,
+               image_url, featured, created_at, updated_at,
+               description, includes, hotel, transport
+        FROM packages WHERE id = ?
+    ''', (package_id,)).fetchone()
+
+def cart_summary(conn, user_id):
+    rows = conn.execute('''
+        SELECT c.id, c.package_id, c.travelers, c.check_in, c.check_out,
+               p.title, p.destination, p.image_url, p.duration, p.price,
+               p.price * c.travelers,
+               SUM(p.price * c.travelers) OVER (), SUM(c.travelers) OVER ()
+        FROM cart c
+        JOIN packages p ON c.package_id = p.id
+        WHERE c.user_id = ?
+        ORDER BY c.id
+    ''', (user_id,)).fetchall()
+    if not rows:
+        return CartSummary([], 0.0, 0)
+    return CartSummary([CartItem(*row[:11]) for row in rows], rows[0][11], rows[0][12])
+
+# Filters of the booking history: status values and trip dates
+BOOKING_STATUSES = ('confirmed', 'pending', 'cancelled')
+BOOKING_WHEN = {'upcoming': "b.check_in >= date('now')", 'past': "b.check_in < date('now')"}
+
+def booking_history(conn, user_id, status=None, when=None, after=None, limit=20):
+    # Newest first, keyset paginated on (created_at, id) and served by the
+    # (user_id[, status], created_at) indexes. Returns the open cursor so the
+    # caller can stream rows as they are read.
+    sql = '''
+        SELECT b.id, b.package_id, b.travelers, b.check_in, b.check_out, b.total_price,
+               b.status, b.created_at, p.title, p.destination, p.image_url
+        FROM bookings b
+        JOIN packages p ON b.package_id = p.id
+        WHERE b.user_id = ?
+    '''
+    params = [user_id]
+    if status in BOOKING_STATUSES:
+        sql += ' AND b.status = ?'
+        params.append(status)
+    if when in BOOKING_WHEN:
+        sql += ' AND ' + BOOKING_WHEN[when]
+    if after:
+        sql += ' AND (b.created_at, b.id) < (?, ?)'
+        params.extend(after)
+    sql += ' ORDER BY b.created_at DESC, b.id DESC LIMIT ?'
+    params.append(limit)
+    return _records(conn, Booking, sql, params)
+
+def batch_booking_emails(conn, batch_token):
+    # Every booking placed by one checkout
+    return _records(conn, BookingEmail, '''
+        SELECT b.id, u.email, u.name, p.title, p.destination, b.check_in, b.check_out,
+               b.travelers, b.total_price, b.payment_method, b.payment_installments
+        FROM bookings b
+        JOIN users u ON u.id = b.user_id
+        JOIN packages p ON p.id = b.package_id
+        WHERE b.batch_token = ?
+        ORDER BY b.id
+    ''', (batch_token,)).fetchall()
+
+def booking_email(conn, booking_id):
+    return _records(conn, BookingEmail, '''
+        SELECT b.id, u.email, u.name, p.title, p.destination, b.check_in, b.check_out,
+               b.travelers, b.total_price, b.payment_method, b.payment_installments
+        FROM bookings b
+        JOIN users u ON u.id = b.user_id
+        JOIN packages p ON p.id = b.package_id
+        WHERE b.id = ?
+    ''', (booking_id,)).fetchone()
+
+class BookingSummary:
+    __slots__ = ('trips', 'spent', 'upcoming')
+
+    def __init__(self, trips, spent, upcoming):
+        self.trips = trips
+        self.spent = spent
+        self.upcoming = upcoming
+
+def booking_summary(conn, user_id):
+    # Confirmed trips and total spent come from booking_stats; upcoming trips
+    # depend on today's date, so they are counted, but only over the index
+    # range of the user's future confirmed bookings
+    row = conn.execute("SELECT bookings, revenue FROM booking_stats WHERE scope = 'user' AND key = ?",
+                       (str(user_id),)).fetchone()
+    upcoming = conn.execute('''
+        SELECT COUNT(*) FROM bookings
+        WHERE user_id = ? AND status = 'confirmed' AND check_in >= date('now')
+    ''', (user_id,)).fetchone()[0]
+    return BookingSummary(row[0] if row else 0, row[1] if row else 0.0, upcoming)
+
+def get_user(conn, user_id):
+    row = conn.execute('SELECT id, email, name, is_admin FROM users WHERE id = ?',
+                       (user_id,)).fetchone()
+    return User(*row) if row else None
+
+def user_credentials(conn, email):
+    # (User, password_hash); the hash never goes into the user caches
+    row = conn.execute('SELECT id, email, name, is_admin, password_hash FROM users WHERE email = ?',
+                       (email,)).fetchone()
+    return (User(*row[:4]), row[4]) if row else (None, None)
+
+def email_taken(conn, email):
+    return conn.execute('SELECT 1 FROM users WHERE email = ?', (email,)).fetchone() is not None
@@ -0,0 +1,42 @@
+// Writes .br and .gz next to every text asset in static/dist so the app can
+// serve them precompressed at maximum quality instead of compressing per
+// request. Variants that would not be smaller are skipped.
+import { readdirSync, readFileSync, writeFileSync } from 'node:fs';
+import { extname, join } from 'node:path';
+import { brotliCompressSync, constants, gzipSync } from 'node:zlib';
+
+const root = process.argv[2] || 'static/dist';
+const COMPRESSIBLE = new Set(['.css', '.js', '.svg', '.ttf', '.json']);
+
+function* files(dir) {
+  for (const entry of readdirSync(dir, { withFileTypes: true })) {
+    const path = join(dir, entry.name);
+    if (entry.isDirectory()) {
+      yield* files(path);
+    } else if (COMPRESSIBLE.has(extname(entry.name))) {
+      yield path;
+    }
+  }
+}
+
+let saved = 0;
+for (const path of files(root)) {
+  const data = readFileSync(path);
+  const variants = {
+    '.br': brotliCompressSync(data, {
+      params: {
+        [constants.BROTLI_PARAM_QUALITY]: constants.BROTLI_MAX_QUALITY,
+        [constants.BROTLI_PARAM_SIZE_HINT]: data.length,
+      },
+    }),
+    '.gz': gzipSync(data, { level: constants.Z_BEST_COMPRESSION }),
+  };
+  for (const [suffix, body] of Object.entries(variants)) {
+    if (body.length < data.length) {
+      writeFileSync(path + suffix, body);
+      saved += data.length - body.length;
+    }
+  }
+  console.log(`${path} ${data.length} -> br ${variants['.br'].length}, gz ${variants['.gz'].length}`);
+}
+console.log(`compressed variants save ${saved} bytes in total`);
@@ -0,0 +1,54 @@
+// PostCSS plugin that drops Font Awesome icon rules (`.fa-star::before`,
+// `.fa-star { --fa: ... }`) for icons no template or script mentions. The full
+// icon list is ~2000 rules; the site uses a few dozen. An icon is kept when
+// `fa-<name>` or a bare `<name>` token appears in the content files, so class
+// names built in templates (`fa-{% if ... %}check-circle{% endif %}`) survive.
+import { readdirSync, readFileSync } from 'node:fs';
+import { join } from 'node:path';
+
+const ICON_SELECTOR = /^\.fa-([a-z0-9-]+)(::?before|::?after)?$/;
+// Family classes the `fas`/`fab` shorthands rely on
+const STYLES = new Set(['solid', 'regular', 'brands', 'classic']);
+
+function contentTokens(dirs) {
+  const tokens = new Set();
+  const walk = (dir) => {
+    for (const entry of readdirSync(dir, { withFileTypes: true })) {
+      const path = join(dir, entry.name);
+      if (entry.isDirectory()) {
+        walk(path);
+      } else if (/\.(html|js)$/.test(entry.name)) {
+        for (const token of readFileSync(path, 'utf8').match(/[a-z0-9-]+/g) || []) {
+          tokens.add(token);
+        }
+      }
+    }
+  };
+  dirs.forEach(walk);
+  return tokens;
+}
+
+export default function iconSubset({ content }) {
+  return {
+    postcssPlugin: 'icon-subset',
+    Once(root) {
+      const tokens = contentTokens(content);
+      const used = (name) => STYLES.has(name) || tokens.has('fa-' + name) || tokens.has(name);
+      root.walkRules((rule) => {
+        // Only rules made entirely of `.fa-*` selectors; rules shared with
+        // the shorthands (.fa, .fas, ...) and keyframes are never touched
+        const icons = rule.selectors.map((selector) => selector.trim().match(ICON_SELECTOR));
+        if (icons.some((match) => !match)) {
+          return;
+        }
+        const kept = rule.selectors.filter((selector, i) => used(icons[i][1]));
+        if (kept.length === 0) {
+          rule.remove();
+        } else if (kept.length < rule.selectors.length) {
+          rule.selectors = kept;
+        }
+      });
+    },
+  };
+}
+iconSubset.postcss = true;
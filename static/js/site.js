@@ -0,0 +1,59 @@
+// Behaviour shared by every page that extends base.html. Bundled through
+// assets/main.js; loaded on its own when there is no build (see base.html).
+
+// Refresh the cart badge without a reload (the page already renders the count)
+export function updateCartCount() {
+    const cartCount = document.getElementById('cart-count');
+    // The badge is only rendered for signed-in users
+    if (!cartCount) {
+        return;
+    }
+    fetch('/api/cart_count')
+        .then(response => response.json())
+        .then(data => {
+            cartCount.textContent = data.count;
+            cartCount.style.display = data.count > 0 ? 'flex' : 'none';
+        });
+}
+
+// Page scripts still inline in their templates call this
+window.updateCartCount = updateCartCount;
+
+document.addEventListener('click', event => {
+    // <button data-toggle="mobile-menu"> shows and hides #mobile-menu
+    const toggle = event.target.closest('[data-toggle]');
+    if (toggle) {
+        document.getElementById(toggle.dataset.toggle)?.classList.toggle('hidden');
+        return;
+    }
+
+    // <button data-dismiss="alert"> removes the enclosing .alert
+    const dismiss = event.target.closest('[data-dismiss]');
+    if (dismiss) {
+        dismiss.closest('.' + dismiss.dataset.dismiss)?.remove();
+        return;
+    }
+
+    // Smooth scroll for anchor links
+    const anchor = event.target.closest('a[href^="#"]');
+    if (anchor) {
+        event.preventDefault();
+        const href = anchor.getAttribute('href');
+        const target = href.length > 1 ? document.querySelector(href) : null;
+        if (target) {
+            target.scrollIntoView({
+                behavior: 'smooth'
+            });
+        }
+    }
+});
+
+// Auto-hide flash messages
+setTimeout(() => {
+    const alerts = document.querySelectorAll('.alert');
+    alerts.forEach(alert => {
+        alert.style.transition = 'opacity 0.5s ease';
+        alert.style.opacity = '0';
+        setTimeout(() => alert.remove(), 500);
+    });
+}, 5000);
@@ -1,8 +1,39 @@
 /** @type {import('tailwindcss').Config} */
 export default {
-  content: ['./index.html', './src/**/*.{js,ts,jsx,tsx}'],
+  content: ['./templates/**/*.html', './assets/**/*.js', './static/js/**/*.js'],
   theme: {
-    extend: {},
+    extend: {
+      colors: {
+        'cvc-yellow': '#FFD700',
+        'cvc-dark-yellow': '#FFC107',
+        'cvc-orange': '#FF8C00',
+        'cvc-red': '#DC143C',
+        'cvc-blue': '#1E3A8A',
+        'cvc-light-blue': '#3B82F6',
+      },
+      animation: {
+        'fade-in': 'fadeIn 0.5s ease-in-out',
+        'slide-up': 'slideUp 0.3s ease-out',
+        'bounce-in': 'bounceIn 0.6s ease-out',
+        'pulse-slow': 'pulse 3s infinite',
+      },
+      keyframes: {
+        fadeIn: {
+          from: { opacity: '0' },
+          to: { opacity: '1' },
+        },
+        slideUp: {
+          from: { transform: 'translateY(20px)', opacity: '0' },
+          to: { transform: 'translateY(0)', opacity: '1' },
+        },
+        bounceIn: {
+          '0%': { transform: 'scale(0.3)', opacity: '0' },
+          '50%': { transform: 'scale(1.05)' },
+          '70%': { transform: 'scale(0.9)' },
+          '100%': { transform: 'scale(1)', opacity: '1' },
+        },
+      },
+    },
   },
   plugins: [],
 };
@@ -1,10 +1,20 @@
 import { defineConfig } from 'vite';
-import react from '@vitejs/plugin-react';
 
-// https://vitejs.dev/config/
+// Builds the site's CSS and JS for Flask: assets/main.js (which imports
+// main.css) becomes static/dist/assets/main-<hash>.{js,css} and
+// manifest.json maps the source entry to those files for asset_bundle()
+// in app.py.
 export default defineConfig({
-  plugins: [react()],
-  optimizeDeps: {
-    exclude: ['lucide-react'],
+  base: '/static/dist/',
+  publicDir: false,
+  build: {
+    outDir: 'static/dist',
+    // Keep the previous build's files: pages cached before a deploy still
+    // reference them
+    emptyOutDir: false,
+    manifest: 'manifest.json',
+    rollupOptions: {
+      input: 'assets/main.js',
+    },
   },
 });